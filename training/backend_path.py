@@ -0,0 +1,11 @@
+'''
+Makes the modules of the backend shared with the training (stress indices, crop thresholds, rolling aggregates)
+importable. Import it before them.
+'''
+import os
+import sys
+
+BACKEND_APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'website', 'backend', 'app')
+
+if BACKEND_APP_DIR not in sys.path:
+    sys.path.append(BACKEND_APP_DIR)
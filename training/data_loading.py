@@ -0,0 +1,50 @@
+'''
+DataLoader over the training arrays, copied once into contiguous tensors.
+
+Batches are gathered with a single indexing of the tensors per batch (the sampler yields the indices of a whole batch),
+instead of collating the samples one by one.
+'''
+import numpy as np
+import torch
+from torch.utils.data import BatchSampler, DataLoader, RandomSampler, SequentialSampler, TensorDataset
+
+
+def make_tensor_dataset(inputs: np.ndarray, labels: np.ndarray, indexes: np.ndarray | None = None) -> TensorDataset:
+    '''
+    Dataset of the rows of inputs and labels selected by indexes (all of them by default), as float32 tensors.
+    Arrays already contiguous and in float32 are shared with the tensors when all their rows are used.
+    '''
+    if indexes is not None:
+        inputs = inputs[indexes]
+        labels = labels[indexes]
+    x = torch.from_numpy(np.ascontiguousarray(inputs, dtype=np.float32))
+    y = torch.from_numpy(np.ascontiguousarray(labels, dtype=np.float32))
+    return TensorDataset(x, y)
+
+
+def make_data_loader(
+    dataset: TensorDataset,
+    batch_size: int,
+    shuffle: bool = True,
+    num_workers: int = 0,
+    pin_memory: bool = False,
+) -> DataLoader:
+    '''
+    Loader of the batches of a dataset, the last batch keeps the remaining samples when it is not full.
+
+    Args:
+        dataset: Tensors of the samples
+        batch_size: Number of samples of a batch
+        shuffle: Shuffle the order of the samples at every epoch
+        num_workers: Processes gathering the batches, 0 to gather them in the training process
+        pin_memory: Copy the batches to page-locked memory, for faster and asynchronous copies to a GPU
+    '''
+    sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return DataLoader(
+        dataset,
+        sampler=BatchSampler(sampler, batch_size, drop_last=False),
+        batch_size=None,  # The sampler gives whole batches, TensorDataset indexes all their samples at once
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        persistent_workers=num_workers > 0,
+    )
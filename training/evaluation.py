@@ -0,0 +1,61 @@
+'''
+Evaluation of the models on a held-out set, in batches and without building autograd graphs.
+
+The errors are summed over all the samples before being divided by their number, so every sample counts the same
+whatever the batch it is in. They are also kept for each output: the outputs of the temperature models are the 12
+weeks of each stress type, the ones of the drought model are the 12 weeks.
+'''
+from typing import Dict, List
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+EVALUATION_BATCH_SIZE = 1024
+
+
+def evaluate(model: torch.nn.Module, loader: DataLoader, device: torch.device) -> Dict[str, np.ndarray]:
+    '''
+    Mean squared and absolute errors of the model over the batches of a loader.
+
+    Returns:
+        mse, mae: Errors of each output, shaped (outputs,)
+    '''
+    was_training = model.training
+    model.eval()
+
+    squared_errors = None
+    absolute_errors = None
+    num_samples = 0
+    with torch.no_grad():
+        for x, y in loader:
+            x = x.to(device, non_blocking=True)
+            y = y.to(device, non_blocking=True)
+            errors = (model(x) - y).double()
+            if squared_errors is None:
+                squared_errors = torch.zeros(errors.shape[1], dtype=torch.float64, device=device)
+                absolute_errors = torch.zeros_like(squared_errors)
+            squared_errors += errors.square().sum(0)
+            absolute_errors += errors.abs().sum(0)
+            num_samples += len(x)
+
+    model.train(was_training)
+    return {
+        'mse': (squared_errors / num_samples).cpu().numpy(),
+        'mae': (absolute_errors / num_samples).cpu().numpy(),
+    }
+
+
+def format_metrics(metrics: Dict[str, np.ndarray], row_names: List[str]) -> str:
+    '''
+    Table of the errors with a row for each group of outputs (stress type) and a column for each week, then the mean
+    of each row. The outputs are ordered by row then by week.
+    '''
+    lines = []
+    for metric, values in metrics.items():
+        values = values.reshape(len(row_names), -1)
+        header = ' '.join(f'{f"w{week + 1}":>7}' for week in range(values.shape[1]))
+        lines.append(f'{metric.upper():<16}{header} {"mean":>7}')
+        for name, row in zip(row_names, values):
+            lines.append(f'{name:<16}' + ' '.join(f'{value:7.4f}' for value in row) + f' {row.mean():7.4f}')
+        lines.append(f'{"all":<16}' + ' ' * (8 * values.shape[1]) + f'{values.mean():7.4f}')
+    return '\n'.join(lines)
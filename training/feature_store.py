@@ -0,0 +1,139 @@
+'''
+Prepared training arrays saved as .npy files, so that only the first run after a change of the data or of the labels
+repeats the extraction from the database.
+
+Each dataset is saved in its own directory, named after a hash of the database contents, of the window sizes and crop
+thresholds and of the source of the functions computing the labels. Any change to them gives a new directory, old
+directories are never read again and can be deleted. The arrays are loaded as read-only memory maps.
+'''
+import os
+import json
+import shutil
+import inspect
+import hashlib
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+import backend_path  # noqa: F401
+import meteoblue_data_adapter as mda
+import stress_index
+import rolling_aggregates
+from risk_calculator import riskCalculatorBatch, droughtRiskCalculator
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dataset', 'cache')
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_digest(path: str | Path) -> str:
+    '''SHA-256 of the contents of a file'''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dataset_key(db_path: str | Path, parameters: dict, sources: list) -> str:
+    '''Hash of everything a dataset depends on: the database, its parameters and the code building it'''
+    digest = hashlib.sha256()
+    digest.update(file_digest(db_path).encode())
+    digest.update(json.dumps(parameters, sort_keys=True).encode())
+    for source in sources:
+        digest.update(inspect.getsource(source).encode())
+    return digest.hexdigest()
+
+
+def load_or_build(
+    name: str,
+    db_path: str | Path,
+    parameters: dict,
+    sources: list,
+    build: Callable[[], Dict[str, np.ndarray]],
+    cache_dir: str | Path = CACHE_DIR,
+) -> Dict[str, np.ndarray]:
+    '''
+    Load the arrays of a dataset from the cache, after building and saving them if they are missing.
+
+    Args:
+        name: Name of the dataset, prefix of its directory
+        db_path: Path to the SQLite database file the dataset is built from
+        parameters: JSON-serializable parameters of the dataset (window sizes, thresholds...)
+        sources: Modules and functions whose code changes the dataset
+        build: Builds the arrays of the dataset by name
+
+    Returns:
+        The arrays by name, as read-only memory maps
+    '''
+    key = dataset_key(db_path, parameters, sources)
+    directory = os.path.join(cache_dir, f'{name}-{key[:16]}')
+
+    if not os.path.isdir(directory):
+        # Written next to the final directory then renamed, a dataset directory is never seen half written
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary_directory = f'{directory}.{os.getpid()}.tmp'
+        os.makedirs(temporary_directory, exist_ok=True)
+        for array_name, array in build().items():
+            np.save(os.path.join(temporary_directory, f'{array_name}.npy'), np.ascontiguousarray(array))
+        try:
+            os.rename(temporary_directory, directory)
+        except OSError:
+            # Saved in the meantime by another process
+            shutil.rmtree(temporary_directory)
+
+    return {
+        file_name[:-len('.npy')]: np.load(os.path.join(directory, file_name), mmap_mode='r')
+        for file_name in sorted(os.listdir(directory))
+        if file_name.endswith('.npy')
+    }
+
+
+def load_temperature_dataset(
+    db_path: str | Path, crop_types: List[str], cache_dir: str | Path = CACHE_DIR
+) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Cached build_temperature_dataset. Only the alternated temperatures are saved for the inputs, the windows are
+    strided views over their memory map.
+    '''
+    def build():
+        temp_max, temp_min = mda.load_temperature_columns(db_path)
+        return {
+            'temperatures': mda.alternate_temperatures(temp_max, temp_min),
+            'labels': mda.temperature_labels(temp_max, temp_min, crop_types),
+        }
+
+    parameters = {
+        'days_in_two_years': mda.DAYS_IN_TWO_YEARS,
+        'days_in_prediction': mda.DAYS_IN_PREDICTION,
+        'days_in_12_weeks': mda.DAYS_IN_12_WEEKS,
+        'crop_types': [crop.lower() for crop in crop_types],
+        'thresholds': stress_index.get_thresholds(crop_types).tolist(),
+    }
+    sources = [
+        stress_index,
+        riskCalculatorBatch,
+        mda.load_temperature_columns,
+        mda.alternate_temperatures,
+        mda.temperature_windows,
+        mda.temperature_labels,
+    ]
+    arrays = load_or_build('temperature', db_path, parameters, sources, build, cache_dir)
+
+    labels = arrays['labels']
+    return mda.temperature_windows(arrays['temperatures'], len(labels)), labels
+
+
+def load_drought_dataset(db_path: str | Path, cache_dir: str | Path = CACHE_DIR) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Cached get_last30_days_sum.
+
+    Returns:
+        features: Past then present sums shaped (windows, 8), in the order of get_last30_days_sum
+        labels: Drought indices of the next 12 weeks shaped (windows, 12)
+    '''
+    def build():
+        data = mda.get_last30_days_sum(db_path)
+        return {'features': np.column_stack(data[:8]), 'labels': data[8]}
+
+    sources = [rolling_aggregates, droughtRiskCalculator, mda.get_last30_days_sum]
+    arrays = load_or_build('drought', db_path, {}, sources, build, cache_dir)
+    return arrays['features'], arrays['labels']
@@ -2,7 +2,10 @@ from typing import List, Iterator, Tuple
 from pathlib import Path
 import sqlite3
 import numpy as np
-from risk_calculator import riskCalculator, droughtRiskCalculator
+from numpy.lib.stride_tricks import sliding_window_view
+import backend_path  # noqa: F401
+from risk_calculator import riskCalculator, riskCalculatorBatch, droughtRiskCalculator
+from rolling_aggregates import prefix_sums, window_sum  # Shared with the backend
 
 def get_meteoblue_data_historical_forecast_from_sqlite(
     db_path: str | Path,
@@ -196,17 +199,83 @@ def get_meteobluedata_with_risk_numpy(
 
         yield historical_data, forecast_data, risk_data
 
-def get_last30_days_sum(db_path: str | Path) -> tuple[List[float], List[float], List[float], List[float]]:
+
+DAYS_IN_TWO_YEARS = 730
+DAYS_IN_PREDICTION = 8  # Including today + 7 more days
+DAYS_IN_12_WEEKS = 85  # 12 weeks * 7 days + today
+LABEL_CHUNK_SIZE = 4096  # Windows whose labels are computed together, bounds the memory of the daily indices
+
+
+def load_temperature_columns(db_path: str | Path) -> tuple[np.ndarray, np.ndarray]:
+    """Daily temp_max and temp_min of the whole bibo_data table, in day order"""
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT temp_max, temp_min FROM bibo_data ORDER BY rowid ASC").fetchall()
+    conn.close()
+
+    temperatures = np.array(rows, dtype=np.float64).reshape(-1, 2)
+    return temperatures[:, 0], temperatures[:, 1]
+
+
+def alternate_temperatures(temp_max: np.ndarray, temp_min: np.ndarray) -> np.ndarray:
+    """temp_min and temp_max of each day alternated, as float32"""
+    return np.column_stack((temp_min, temp_max)).astype(np.float32).reshape(-1)
+
+
+def temperature_windows(alternated: np.ndarray, num_windows: int) -> np.ndarray:
+    """Inputs of the first num_windows windows, as a read-only strided view over the alternated temperatures"""
+    # Window i starts at value 2i of the alternated temperatures
+    input_size = 2 * (DAYS_IN_TWO_YEARS + DAYS_IN_PREDICTION)
+    return sliding_window_view(alternated, input_size)[::2][:num_windows]
+
+
+def temperature_labels(temp_max: np.ndarray, temp_min: np.ndarray, crop_types: List[str]) -> np.ndarray:
+    """Heat, frost and night risks of the 12 weeks following the history of each window, shaped (windows, crops, 36)"""
+    num_windows = len(temp_max) - DAYS_IN_TWO_YEARS - DAYS_IN_12_WEEKS + 1
+    weeks_max = sliding_window_view(temp_max[DAYS_IN_TWO_YEARS:], DAYS_IN_12_WEEKS)[:num_windows]
+    weeks_min = sliding_window_view(temp_min[DAYS_IN_TWO_YEARS:], DAYS_IN_12_WEEKS)[:num_windows]
+
+    labels = np.empty((num_windows, len(crop_types), 36), dtype=np.float32)
+    for start in range(0, num_windows, LABEL_CHUNK_SIZE):
+        stop = start + LABEL_CHUNK_SIZE
+        risks = riskCalculatorBatch(weeks_max[start:stop], weeks_min[start:stop], crop_types)
+        labels[start:stop] = risks.reshape(len(risks), len(crop_types), -1)
+    return labels
+
+
+def build_temperature_dataset(db_path: str | Path, crop_types: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Build the inputs and the labels of the temperature stress models for every window of the history at once,
+    with the same windows as get_meteobluedata_with_risk_numpy.
+
+    Args:
+        db_path: Path to the SQLite database file
+        crop_types: Crops for which the labels are computed
+
+    Returns:
+        X: Inputs shaped (windows, 1476): temp_min and temp_max of each day alternated, for the 2 years of history
+           then the next 8 days. Read-only strided view over a single array of the whole history.
+        y: Stress risks shaped (windows, crops, 36): heat, frost and night risks of the next 12 weeks (0 to 9)
+    """
+    temp_max, temp_min = load_temperature_columns(db_path)
+    y = temperature_labels(temp_max, temp_min, crop_types)
+    X = temperature_windows(alternate_temperatures(temp_max, temp_min), len(y))
+    return X, y
+
+
+def get_last30_days_sum(db_path: str | Path) -> tuple[np.ndarray, ...]:
     """
     Recupera e somma i valori di evaporation_sum, rainfall_sum, soil_moisture_avg e temp_avg
     per gli ultimi 30 giorni dalla tabella bibo_data del database SQLite.
 
+    Le somme di ogni finestra sono calcolate in O(1) con le somme prefisse di ogni colonna.
+
     Args:
         db_path: Path al file del database SQLite.
-    
+
     Returns:
-        Una tupla contenente le somme nell'ordine:
-        (evaporation_sum, rainfall_sum, soil_moisture_avg, temp_avg)
+        Una tupla contenente le somme passate (23 giorni) e presenti (7 giorni) nell'ordine
+        (evaporation_sum, rainfall_sum, soil_moisture_avg, temp_avg), poi gli indici di siccita'
+        delle 12 settimane seguenti, con una riga per finestra
     """
     # Connessione al database SQLite
     conn = sqlite3.connect(db_path)
@@ -218,75 +287,35 @@ def get_last30_days_sum(db_path: str | Path) -> tuple[List[float], List[float],
     ORDER BY rowid ASC
     """
     cursor.execute(query)
-    rows = cursor.fetchall()
+    rows = np.array(cursor.fetchall(), dtype=np.float64).reshape(-1, 4)  # None diventa NaN, contato come 0
     conn.close()
 
-    # Inizializza le somme
-    evaporation_total = 0.0
-    rainfall_total = 0.0
-    soil_moisture_total = 0.0
-    temp_total = 0.0
-
-    sum_evaporation_past = []
-    sum_rainfall_past = []
-    sum_soil_moisture_past = []
-    sum_temp_past = []
-    forecast = []
-    sum_evaporation_present = []
-    sum_rainfall_present = []
-    sum_soil_moisture_present = []
-    sum_temp_present = []
-
-    val = 0
-    # Somma ogni colonna (gestendo eventuali valori None)
-    for i in range(23, len(rows)-84, 7):
-        prediction = []
-        for j in range(0, 23):
-            row = rows[i-j]
-            evaporation_total += row[0] if row[0] is not None else 0.0
-            rainfall_total += row[1] if row[1] is not None else 0.0
-            soil_moisture_total += row[2] if row[2] is not None else 0.0
-            temp_total += row[3] if row[3] is not None else 0.0
-        sum_evaporation_past.append(evaporation_total)
-        sum_rainfall_past.append(rainfall_total)
-        sum_soil_moisture_past.append(soil_moisture_total)
-        sum_temp_past.append(temp_total)
-        evaporation_total = 0.0
-        rainfall_total = 0.0
-        soil_moisture_total = 0.0
-        temp_total = 0.0
-        for j in range(0, 7):
-            row = rows[i+j]
-            evaporation_total += row[0] if row[0] is not None else 0.0
-            rainfall_total += row[1] if row[1] is not None else 0.0
-            soil_moisture_total += row[2] if row[2] is not None else 0.0
-            temp_total += row[3] if row[3] is not None else 0.0
-        sum_evaporation_present.append(evaporation_total)
-        sum_rainfall_present.append(rainfall_total)
-        sum_soil_moisture_present.append(soil_moisture_total)
-        sum_temp_present.append(temp_total)
-
-        for j in range(7, 85):
-            row = rows[j+i]
-            evaporation_total += row[0] if row[0] is not None else 0.0
-            rainfall_total += row[1] if row[1] is not None else 0.0
-            soil_moisture_total += row[2] if row[2] is not None else 0.0
-            temp_total += row[3] if row[3] is not None else 0.0
-            risk = droughtRiskCalculator(evaporation_total, rainfall_total, soil_moisture_total, temp_total)
-            if risk > 1:
-                val += 0
-            elif risk == 1:
-                val += 0.5
-            else:
-                val += 1
-            if j % 7 == 0:
-                prediction.append(val/7)
-                val = 0
-        forecast.append(prediction)
-        prediction = []
+    prefixes = [prefix_sums(rows[:, column]) for column in range(4)]
+
+    # Una finestra ogni 7 giorni
+    starts = np.arange(23, len(rows) - 84, 7)
+
+    # Somme passate: i 23 giorni fino a oggi, piu' i totali della finestra precedente (85 giorni dal suo inizio)
+    # che non venivano azzerati
+    leftover = np.where(starts > 23, 1.0, 0.0)
+    past = [
+        window_sum(prefix, starts - 22, starts + 1) + leftover * window_sum(prefix, starts - 7, starts + 78)
+        for prefix in prefixes
+    ]
+
+    # Somme presenti: i 7 giorni da oggi
+    present = [window_sum(prefix, starts, starts + 7) for prefix in prefixes]
+
+    # Totali cumulati da oggi fino al giorno j, per j da 7 a 84
+    days = np.arange(7, 85)
+    totals = [window_sum(prefix, starts[:, None], starts[:, None] + days + 1) for prefix in prefixes]
+    risk = droughtRiskCalculator(*totals)
+    scores = np.where(risk > 1, 0.0, np.where(risk == 1, 0.5, 1.0))
 
+    # La prima settimana conta solo il giorno 7, le altre i 7 giorni fino al giorno 14, 21, ..., 84
+    forecast = np.concatenate([scores[:, :1], scores[:, 1:].reshape(len(starts), 11, 7).sum(axis=2)], axis=1) / 7
 
-    return sum_evaporation_past, sum_rainfall_past, sum_soil_moisture_past, sum_temp_past, sum_evaporation_present, sum_rainfall_present, sum_soil_moisture_present, sum_temp_present, forecast
+    return (*past, *present, forecast)
 
 
 if __name__ == "__main__":
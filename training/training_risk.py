@@ -1,89 +1,136 @@
-from neural_network_drought import NN_drought
+'''
+Train the temperature stress models of one or several crops.
+
+The inputs are the same for every crop, only the labels change with the crop thresholds: the windows are built once,
+then the models are trained one after the other on the same inputs, or in parallel processes with --jobs.
+
+Crops are given by name in any case (Wheat, wheat) or as 'all'. The model of a crop is saved as
+risk_model_{name}.pth with the names of MODEL_NAMES (risk_model_SoyBean.pth...), as the models in the models directory.
+'''
 from neural_network_risk import NN_risk
+import os
+import argparse
 import torch
 import numpy as np
 import torch.nn as nn
-import meteoblue_data_adapter as mda
-
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+from concurrent.futures import ProcessPoolExecutor
+from feature_store import load_temperature_dataset
+from data_loading import make_data_loader, make_tensor_dataset
+from evaluation import EVALUATION_BATCH_SIZE, evaluate, format_metrics
+import backend_path  # noqa: F401
+from crops import CROPS
+from stress_index import STRESS_TYPES
 
-neural_network = NN_risk(1476, 36, device).to(device)
+db_path = './dataset/stress_buster_data.db'
 epochs = 100
 learning_rate = 0.1
-optimizer = torch.optim.SGD(neural_network.parameters(), lr=learning_rate)
-criterion = nn.MSELoss()
-
-crop = "Wheat"
-
-res = list(mda.get_meteobluedata_with_risk_numpy('./dataset/stress_buster_data.db', crop))
-historical = []
-forecast = []
-prediction = []
-indexes = np.random.permutation(len(res))
-res = [res[i] for i in indexes]
-for i in range(int(0.7*len(res))):
-    historical.append(res[i][0])
-    forecast.append(res[i][1])
-    prediction.append(res[i][2]/9)
-
 batch_size = 128
-for epoch in range(epochs):
-    indices = np.random.permutation(len(historical))
-    
-    historical_shuffled = [historical[i] for i in indices]
-    forecast_shuffled = [forecast[i] for i in indices]
-    prediction_shuffled = [prediction[i] for i in indices]
-    epoch_loss = 0
-    num_batches = 0
-    for j in range(0, len(historical_shuffled)-batch_size, batch_size):
-        optimizer.zero_grad()
-
-        x = historical_shuffled[j:j+batch_size]
-        f = forecast_shuffled[j:j+batch_size]
-        y = prediction_shuffled[j:j+batch_size]
-
-        x = torch.tensor(np.array(x), dtype=torch.float32).to(device)
-        f = torch.tensor(np.array(f), dtype=torch.float32).to(device)
-        y = torch.tensor(np.array(y), dtype=torch.float32).to(device)
-
-        x = x.reshape((batch_size, -1))
-        f = f.reshape((batch_size, -1))
-        x = torch.cat((x, f), 1).to(device)
-        y = y.reshape((batch_size, 36))
-
-        y_predicted = neural_network(x)
-        loss = criterion(y_predicted, y)
-        loss.backward()
-        optimizer.step()
-        num_batches += 1
-        epoch_loss += loss.item()
-    epoch_loss /= num_batches
-    if epoch % 10 == 0:
-        print(f"Epochs:{epoch}, loss: {epoch_loss}")
-
-test_historical = []
-test_forecast = []
-test_prediction = []
-for i in range(int(0.7*len(res)), len(res)):
-    test_historical.append(res[i][0])
-    test_forecast.append(res[i][1])
-    test_prediction.append(res[i][2]/9)
-loss = 0
-for j in range(0, len(test_historical)):
-    x = test_historical[j]
-    f = test_forecast[j]
-    y = test_prediction[j]
-
-    x = torch.tensor(np.array(x), dtype=torch.float32).to(device)
-    f = torch.tensor(np.array(f), dtype=torch.float32).to(device)
-    y = torch.tensor(np.array(y), dtype=torch.float32).to(device)
-    x = x.reshape((1, -1))
-    f = f.reshape((1, -1))
-    x = torch.cat((x, f), 1).to(device)
-    y = y.reshape((1, 36))
-
-    y_predicted = neural_network(x)
-    loss += criterion(y_predicted, y)
-print("Average loss: ", loss/len(test_historical))
-
-neural_network.save(f'risk_model_{crop}.pth')
\ No newline at end of file
+num_workers = 0
+
+# Names of the saved models of each crop of crops.CROPS
+MODEL_NAMES = {'soybean': 'SoyBean', 'corn': 'Corn', 'cotton': 'Cotton', 'rice': 'Rice', 'wheat': 'Wheat'}
+
+
+def parse_crops(names):
+    '''Crops of crops.CROPS given on the command line, in any case, or all of them for ['all']'''
+    if [name.lower() for name in names] == ['all']:
+        return list(CROPS)
+    crop_types = list(dict.fromkeys(name.lower() for name in names))
+    unknown = [crop for crop in crop_types if crop not in CROPS]
+    if unknown:
+        raise ValueError(f"Unknown crops: {', '.join(unknown)} (choose among {', '.join(CROPS)} or 'all')")
+    return crop_types
+
+
+def train_crop(crop, train_inputs, train_labels, test_inputs, test_labels, args):
+    '''Train the model of a crop on labels already divided by 9 and save it to risk_model_{MODEL_NAMES[crop]}.pth'''
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    neural_network = NN_risk(1476, 36, device).to(device)
+    optimizer = torch.optim.SGD(neural_network.parameters(), lr=args.learning_rate)
+    criterion = nn.MSELoss()
+
+    pin_memory = device.type == 'cuda'
+    train_dataset = make_tensor_dataset(train_inputs, train_labels)
+    train_loader = make_data_loader(train_dataset, args.batch_size, True, args.num_workers, pin_memory)
+    test_dataset = make_tensor_dataset(test_inputs, test_labels)
+    test_loader = make_data_loader(test_dataset, EVALUATION_BATCH_SIZE, False, 0, pin_memory)
+    for epoch in range(args.epochs):
+        epoch_loss = 0
+        for x, y in train_loader:
+            optimizer.zero_grad()
+
+            x = x.to(device, non_blocking=True)
+            y = y.to(device, non_blocking=True)
+
+            y_predicted = neural_network(x)
+            loss = criterion(y_predicted, y)
+            loss.backward()
+            optimizer.step()
+            epoch_loss += loss.item() * len(x)
+        epoch_loss /= len(train_dataset)
+        if epoch % args.eval_every == 0:
+            test_loss = evaluate(neural_network, test_loader, device)['mse'].mean()
+            print(f"{crop} Epochs:{epoch}, loss: {epoch_loss}, test loss: {test_loss}")
+
+    metrics = evaluate(neural_network, test_loader, device)
+    print(f"{crop} Average loss: {metrics['mse'].mean()}")
+    print(format_metrics(metrics, STRESS_TYPES))
+
+    path = f'risk_model_{MODEL_NAMES[crop]}.pth'
+    neural_network.save(path)
+    return path
+
+
+def train_crop_in_worker(crop, crop_types, train_indexes, test_indexes, args):
+    '''train_crop in a worker process, which reads the windows from the cache instead of receiving them'''
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // args.jobs))
+    inputs, labels = load_temperature_dataset(args.db, crop_types)
+    crop_labels = labels[:, crop_types.index(crop)] / 9
+    return train_crop(
+        crop, inputs[train_indexes], crop_labels[train_indexes], inputs[test_indexes], crop_labels[test_indexes], args
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the temperature stress models")
+    parser.add_argument('--crops', nargs='+', default=['Wheat'], help="Crops to train (any case), or 'all'")
+    parser.add_argument('--jobs', type=int, default=1, help="Crops trained at the same time, in separate processes")
+    parser.add_argument('--db', default=db_path)
+    parser.add_argument('--epochs', type=int, default=epochs)
+    parser.add_argument('--learning-rate', type=float, default=learning_rate)
+    parser.add_argument('--batch-size', type=int, default=batch_size)
+    parser.add_argument('--num-workers', type=int, default=num_workers, help="DataLoader worker processes")
+    parser.add_argument('--eval-every', type=int, default=10, help="Epochs between two evaluations on the test set")
+    args = parser.parse_args()
+
+    try:
+        crop_types = parse_crops(args.crops)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Labels of every crop computed together, the same split is used for every crop
+    inputs, labels = load_temperature_dataset(args.db, crop_types)
+    indexes = np.random.permutation(len(inputs))
+    train_size = int(0.7*len(inputs))
+    train_indexes = np.sort(indexes[:train_size])
+    test_indexes = indexes[train_size:]
+
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [
+                executor.submit(train_crop_in_worker, crop, crop_types, train_indexes, test_indexes, args)
+                for crop in crop_types
+            ]
+            paths = [future.result() for future in futures]
+    else:
+        # Gathered once for all the crops
+        train_inputs = np.ascontiguousarray(inputs[train_indexes])
+        test_inputs = inputs[test_indexes]
+        paths = []
+        for k, crop in enumerate(crop_types):
+            crop_labels = labels[:, k] / 9
+            paths.append(
+                train_crop(crop, train_inputs, crop_labels[train_indexes], test_inputs, crop_labels[test_indexes], args)
+            )
+    print("Saved", ", ".join(paths))
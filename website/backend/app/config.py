@@ -10,33 +10,90 @@ HISTORICAL_API_KEY = os.getenv("HISTORICAL_API_KEY")
 FORECAST_API_URL = "https://services.cehub.syngenta-ais.com/api/Forecast/ShortRangeForecastDaily"
 FORECAST_SUPPLIER = "Meteoblue"
 FORECAST_DAYS = 8  # Today and a week after
+FORECAST_HTTP2 = True
+FORECAST_MAX_CONNECTIONS = 100
+FORECAST_MAX_KEEPALIVE_CONNECTIONS = 20
+FORECAST_KEEPALIVE_EXPIRY_SECONDS = 30
+FORECAST_CONNECT_TIMEOUT_SECONDS = 5
+FORECAST_TIMEOUT_SECONDS = 20
 
 # Historical data
 HISTORICAL_API_URL = "http://my.meteoblue.com/dataset/query"
 METEOBLUE_DATE_FORMAT = "%Y-%m-%d"
+HISTORICAL_TIMEOUT_SECONDS = 60
 
 # Position
 SORRISO_LATITUDE = -12.5471531
 SORRISO_LONGITUDE = -55.7319178
 SORRISO_NAME = "Sorriso"
+COORDINATE_PRECISION = 2  # Decimal digits kept when keying data by location (about 1 km)
 
 # Uvicorn
 HOST = "0.0.0.0"
 PORT = 8123
 DEBUG_MODE = True
+WORKERS = int(os.getenv("WORKERS", "1"))  # Ignored in debug mode (reload)
+
+# Startup (resources are loaded in the background, the server accepts requests immediately)
+RESOURCE_LOADER_THREADS = 4
+FAST_START = os.getenv("FAST_START", "false").lower() == "true"  # Start from the local history, backfill later
+
+# Inference (predictions run in a thread pool, outside of the event loop)
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Threads used by each prediction, in PyTorch, ONNX Runtime or the BLAS library of NumPy
+INFERENCE_NUM_THREADS = int(os.getenv("INFERENCE_NUM_THREADS", "1"))
+INFERENCE_MAX_BATCH_SIZE = 64  # Concurrent predictions of a model run in a single forward pass
+INFERENCE_MAX_WAIT_MS = 2  # Time a prediction waits for others to join its batch
 
 # Resources
-HISTORICAL_WEATHER_DB_PATH = "./resources/stress_buster_historical_data.db"
+HISTORICAL_WEATHER_DB_PATH = "./resources/stress_buster_historical_data.db"  # Sorriso
+HISTORICAL_WEATHER_DB_PATH_TEMPLATE = "./resources/historical_weather/historical_data_{}_{}.db"  # Other locations
+HISTORICAL_STORE_DIR_TEMPLATE = "./resources/historical_store/{}_{}"  # Memory-mapped copy of the databases
 TEMP_STRESS_MODEL_PATH_TEMPLATE = "./resources/temp_stress_models/temp_stress_model_{}.pth"
 DROUGHT_STRESS_MODEL_PATH_TEMPLATE = "./resources/drought_stress_model.pth"
+EXPORTED_MODEL_PATH_TEMPLATE = "./resources/exported_models/{}.{}"  # Written by export_models.py
 
 # Neural networks
 TEMP_STRESS_INPUT_SIZE = 1476  # Min and max temperatures for 2 years + 8 days
 TEMP_STRESS_OUTPUT_SIZE = 36  # 3 temperature stress for 12 weeks
+# Models served: "numpy" (fp32 state dicts, without PyTorch), "eager" (same weights, with PyTorch),
+# "torchscript" or "onnx" (int8, exported by export_models.py). All but "numpy" need requirements-export.txt
+MODEL_FORMAT = os.getenv("MODEL_FORMAT", "numpy")
+TEMP_STRESS_FUSED = True  # Run the models of all the crops together when several crops are predicted
 
 DROUGHT_STRESS_INPUT_SIZE = 8  # 4 values for historical and 4 for forecast
 DROUGHT_STRESS_OUTPUT_SIZE = 12  # Drought index for each of the 12 weeks
 
+# Cache backend: "memory" (private to each worker), "sqlite" (shared by the workers on the machine) or "redis"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_SQLITE_PATH = "./resources/cache/shared_cache.db"
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+FORECAST_CACHE_PERSISTENT = True  # Keep the forecasts on disk when the cache backend is "memory"
+FORECAST_CACHE_DB_PATH = "./resources/cache/forecast_cache.db"
+CACHE_LOCK_LEASE_SECONDS = 30  # Time a worker waits for another one computing the same entry
+CACHE_LOCK_POLL_SECONDS = 0.05
+
+# Cache (limits for the whole cache and for each category, identified by its value)
+CACHE_MAX_ENTRIES = 50_000
+CACHE_MAX_BYTES = 512 * 1024**2
+CACHE_CATEGORY_MAX_ENTRIES = {
+    "temp_stress_prediction": 25_000,
+    "drought_stress_prediction": 10_000,
+}
+CACHE_CATEGORY_MAX_BYTES = {
+    "weather_forecast": 64 * 1024**2,
+    "database_data": 256 * 1024**2,
+}
+
 # Prediction
 NUM_DAYS_TEMP_STRESS_PREDICTION = 2 * 365
 NUM_DAYS_DROUGHT_STRESS_PREDICTION = 30
+MAX_BATCH_PREDICTION_ITEMS = 5000  # (location, crop) pairs accepted by a single batch request
+BATCH_PREDICTION_CONCURRENT_LOCATIONS = FORECAST_MAX_CONNECTIONS // 6  # Batch locations loaded at once, 6 requests each
+HISTORICAL_REFRESH_TIME = "00:00"  # Daily refresh of the historical weather (server local time, HH:MM)
+HISTORICAL_REFRESH_CONCURRENCY = 8  # Locations whose new days are fetched at the same time by the daily refresh
+HISTORICAL_REFRESH_LOCK_PATH = "./resources/historical_store/.refresh.lock"  # Workers refresh one after the other
+HISTORICAL_REFRESH_RETRY_SECONDS = 600  # Time before the requests fetch again missing days of a location's history
+PREWARM_LOCATIONS = [(SORRISO_LATITUDE, SORRISO_LONGITUDE)]  # Predictions computed ahead of the requests
+PREWARM_CROPS = None  # All the crops if None
+HISTORICAL_BACKFILL_DAYS = NUM_DAYS_TEMP_STRESS_PREDICTION + 1  # Days fetched when a new location is first requested
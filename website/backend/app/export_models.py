@@ -0,0 +1,167 @@
+"""
+Export the serving models with int8 weights, as TorchScript or ONNX, for the backend to load when MODEL_FORMAT selects
+them.
+
+The Linear layers are quantized dynamically (int8 weights, activations quantized on the fly). The exported models are
+then compared with the fp32 ones on the historical weather of Sorriso, the command fails if they differ too much.
+Run from website/backend: python app/export_models.py --format torchscript
+"""
+
+import os
+import sys
+import argparse
+import sqlite3
+import numpy as np
+import pandas as pd
+import torch
+from numpy.lib.stride_tricks import sliding_window_view
+
+import config as c
+import crops
+from neural_networks.neural_network_temp_stress import NN_temp_stress
+from neural_networks.torch_models import load_drought_stress_model, load_temp_stress_model, run_torch_model
+from util.load_resources import TORCH_MODEL_FORMATS, get_exported_model_path, load_exported_model
+
+FORECAST_DAYS = c.FORECAST_DAYS
+
+
+def load_historical_weather() -> pd.DataFrame:
+    weather_db = sqlite3.connect(c.HISTORICAL_WEATHER_DB_PATH)
+    weather_df = pd.read_sql_query("SELECT * FROM historical_weather_data ORDER BY date", weather_db)
+    weather_db.close()
+    return weather_df
+
+
+def build_evaluation_features(weather_df: pd.DataFrame, stride: int) -> tuple[np.ndarray, np.ndarray]:
+    # Inputs of the models for days of the history, the 8 days following each one are used as forecast
+    temp = weather_df[["temp_max", "temp_min"]].to_numpy(dtype=np.float32)
+    temp_days = c.NUM_DAYS_TEMP_STRESS_PREDICTION + FORECAST_DAYS
+    temp_windows = sliding_window_view(temp, temp_days, axis=0)[::stride]  # (samples, 2, days)
+    temp_features = temp_windows.transpose(0, 2, 1).reshape(len(temp_windows), -1)  # Alternate max and min
+
+    # Drought inputs: sums or means of the forecast days, then of the previous days
+    reductions = {
+        "evaporation_sum": np.nansum,
+        "rainfall_sum": np.nansum,
+        "soil_moisture_avg": np.nanmean,
+        "temp_avg": np.nanmean,
+    }
+    history_days = c.NUM_DAYS_DROUGHT_STRESS_PREDICTION
+    offset = temp_days - history_days - FORECAST_DAYS  # Same end day as the temperature windows
+    drought_windows = {
+        column: sliding_window_view(
+            weather_df[column].to_numpy(dtype=np.float64)[offset:], history_days + FORECAST_DAYS
+        )
+        for column in reductions
+    }
+    forecast = [
+        reduction(drought_windows[column][:, history_days:], axis=1) for column, reduction in reductions.items()
+    ]
+    history = [reduction(drought_windows[column][:, :history_days], axis=1) for column, reduction in reductions.items()]
+    drought_features = np.stack(forecast + history, axis=1)[::stride].astype(np.float32)
+
+    return np.ascontiguousarray(temp_features), drought_features
+
+
+class FusedTempStressExport(torch.nn.Module):
+    """
+    Same outputs as NN_temp_stress_fused, with every layer kept as a Linear so that all the weights are quantized.
+
+    NN_temp_stress_fused stacks the second and third layers into plain parameters for its batched matmuls, which the
+    dynamic quantization leaves in fp32. Here only the first layers are concatenated, the next ones are the layers of
+    each crop model.
+    """
+
+    def __init__(self, models: list[NN_temp_stress]):
+        super().__init__()
+        self.num_models = len(models)
+        self.hidden_size = models[0].fc1.out_features
+
+        with torch.no_grad():
+            self.fc1 = torch.nn.Linear(models[0].fc1.in_features, self.num_models * self.hidden_size)
+            self.fc1.weight.copy_(torch.cat([model.fc1.weight for model in models]))
+            self.fc1.bias.copy_(torch.cat([model.fc1.bias for model in models]))
+        self.fc2 = torch.nn.ModuleList([model.fc2 for model in models])
+        self.fc3 = torch.nn.ModuleList([model.fc3 for model in models])
+
+    def forward(self, state):
+        x = torch.relu(self.fc1(state.reshape(-1, state.shape[-1])))
+        hidden = x.view(-1, self.num_models, self.hidden_size).unbind(1)
+        outputs = [torch.sigmoid(fc3(torch.relu(fc2(h)))) for h, fc2, fc3 in zip(hidden, self.fc2, self.fc3)]
+        return torch.stack(outputs, dim=1)  # (batch, models, output)
+
+
+def export_model(model: torch.nn.Module, example: torch.Tensor, model_format: str, path: str):
+    if model_format == "torchscript":
+        quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        with torch.no_grad():
+            scripted = torch.jit.freeze(torch.jit.trace(quantized, example).eval())
+        scripted.save(path)
+        return
+
+    # ONNX models are quantized by ONNX Runtime, from an fp32 export
+    from onnxruntime.quantization import QuantType, quantize_dynamic  # Optional dependency
+
+    fp32_path = path + ".fp32"
+    torch.onnx.export(
+        model,
+        (example,),
+        fp32_path,
+        input_names=["features"],
+        output_names=["stress"],
+        dynamic_axes={"features": {0: "batch"}, "stress": {0: "batch"}},
+        dynamo=False,
+    )
+    quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+
+def compare_outputs(
+    name: str, fp32_model: torch.nn.Module, exported_model, features: np.ndarray, model_format: str
+) -> float:
+    # Differences of the raw outputs, and share of the stress indices returned by the API (floor(10 x)) that change
+    cpu = torch.device("cpu")
+    expected = run_torch_model(fp32_model, features, cpu)
+    if model_format in TORCH_MODEL_FORMATS:
+        exported = run_torch_model(exported_model, features, cpu)
+    else:
+        exported = exported_model(features)
+
+    differences = np.abs(exported - expected)
+    changed_indices = np.mean(np.floor(exported * 10) != np.floor(expected * 10))
+    print(
+        f"{name:>28} {differences.max():>10.5f} {differences.mean():>10.5f} {changed_indices:>15.2%} "
+        f"{os.path.getsize(get_exported_model_path(name, model_format)) / 1024**2:>10.2f}"
+    )
+    return differences.max()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the models with int8 weights and check their accuracy")
+    parser.add_argument("--format", choices=["torchscript", "onnx"], default="torchscript")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="Maximum absolute difference of the outputs")
+    parser.add_argument("--stride", type=int, default=7, help="Days between two evaluated samples of the history")
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    temp_stress_models = {crop: load_temp_stress_model(crop, device) for crop in crops.CROPS}
+    models = {f"temp_stress_model_{crop}": model for crop, model in temp_stress_models.items()}
+    models["temp_stress_model_fused"] = FusedTempStressExport(list(temp_stress_models.values())).eval()
+    models["drought_stress_model"] = load_drought_stress_model(device)
+
+    temp_features, drought_features = build_evaluation_features(load_historical_weather(), args.stride)
+
+    os.makedirs(os.path.dirname(get_exported_model_path("model", args.format)), exist_ok=True)
+    print(f"{'model':>28} {'max diff':>10} {'mean diff':>10} {'changed index':>15} {'size (MB)':>10}")
+
+    max_difference = 0.0
+    for name, model in models.items():
+        features = drought_features if name == "drought_stress_model" else temp_features
+        export_model(model, torch.from_numpy(features[:2]), args.format, get_exported_model_path(name, args.format))
+
+        exported_model = load_exported_model(name, args.format)
+        max_difference = max(max_difference, compare_outputs(name, model, exported_model, features, args.format))
+
+    if max_difference > args.tolerance:
+        print(f"Exported models differ from the fp32 ones by up to {max_difference:.5f} (tolerance {args.tolerance})")
+        sys.exit(1)
@@ -1,13 +1,26 @@
 import uvicorn
+import asyncio
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, status, Request
+from fastapi import FastAPI, HTTPException, status, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
 from util.load_resources import GlobalResources
+from util.util import location_key
 import config as c
-from retrieve_forecast import retrieve_all_forecast_data
-from neural_networks.predict_stress import predict_temperature_stress, predict_drought_stress
+import crops
+from schemas import BatchPredictionRequest
+from scheduler import run_scheduler
+from retrieve_forecast import retrieve_all_forecast_data, open_http_client, close_http_client
+from neural_networks.predict_stress import (
+    predict_temperature_stress,
+    predict_temperature_stress_all_crops,
+    predict_drought_stress,
+    predict_temperature_stress_batch,
+    predict_drought_stress_batch,
+    load_historical_weather_store,
+)
+from neural_networks.inference_pool import run_inference, shutdown_inference_pool
 
 app = FastAPI(
     title="Syngenta Product Suggestion",
@@ -44,16 +57,46 @@ async def general_exception_handler(request: Request, exc: Exception):
 # Load resources
 @app.on_event("startup")
 async def startup_event():
-    GlobalResources()  # Load resources
+    GlobalResources().start_loading()  # Load resources in the background
+    await open_http_client()
+    app.state.scheduler_task = asyncio.create_task(run_scheduler())  # Daily refresh and prewarm
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.scheduler_task.cancel()
+    await close_http_client()
+    shutdown_inference_pool()
+
+
+# Location parameters shared by all the routes, Sorriso is used when not specified
+LatitudeQuery = Query(c.SORRISO_LATITUDE, ge=-90, le=90, description="Latitude of the field")
+LongitudeQuery = Query(c.SORRISO_LONGITUDE, ge=-180, le=180, description="Longitude of the field")
+
+
+# Health checks
+@app.get("/health/live", tags=["Health"])
+async def get_liveness():
+    return {"status": "alive"}
+
+
+@app.get("/health/ready", tags=["Health"])
+async def get_readiness():
+    # Ready once all the resources loaded at startup are available
+    resources = GlobalResources()
+    ready = resources.is_ready()
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"ready": ready, "resources": resources.get_loading_status()},
+    )
 
 
 # API routes
 @app.get("/api/forecast", tags=["Forecast"])
-async def get_forecast():
+async def get_forecast(latitude: float = LatitudeQuery, longitude: float = LongitudeQuery):
     try:
         today = datetime.today().strftime("%Y-%m-%d")
-        lat = c.SORRISO_LATITUDE
-        lon = c.SORRISO_LONGITUDE
+        lat, lon = location_key(latitude, longitude)
 
         df = await retrieve_all_forecast_data(lat, lon, today)
 
@@ -65,6 +108,8 @@ async def get_forecast():
             "coordinates": {"latitude": lat, "longitude": lon},
             "forecast": forecast_data,
         }
+    except HTTPException:
+        raise  # Already describes the error, e.g. 504 when the forecast API timed out
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to retrieve forecast data: {str(e)}"
@@ -72,15 +117,37 @@ async def get_forecast():
 
 
 @app.get("/api/predict/temp_stress/{crop}", tags=["Temperature Stress"])
-async def get_temperature_stress_prediction(crop: str):
+async def get_temperature_stress_prediction(
+    crop: str, latitude: float = LatitudeQuery, longitude: float = LongitudeQuery
+):
     try:
         today = datetime.today().strftime("%Y-%m-%d")
-        lat = c.SORRISO_LATITUDE
-        lon = c.SORRISO_LONGITUDE
+        lat, lon = location_key(latitude, longitude)
 
         weather_forecast_df = await retrieve_all_forecast_data(lat, lon, today)
-        return predict_temperature_stress(crop.lower(), weather_forecast_df)
+        return await predict_temperature_stress(crop.lower(), lat, lon, weather_forecast_df)
 
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to predict temperature stress: {str(e)}"
+        )
+
+
+@app.get("/api/predict/temp_stress", tags=["Temperature Stress"])
+async def get_temperature_stress_prediction_all_crops(
+    latitude: float = LatitudeQuery, longitude: float = LongitudeQuery
+):
+    try:
+        today = datetime.today().strftime("%Y-%m-%d")
+        lat, lon = location_key(latitude, longitude)
+
+        weather_forecast_df = await retrieve_all_forecast_data(lat, lon, today)
+        return await predict_temperature_stress_all_crops(lat, lon, weather_forecast_df)
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to predict temperature stress: {str(e)}"
@@ -88,20 +155,90 @@ async def get_temperature_stress_prediction(crop: str):
 
 
 @app.get("/api/predict/drought_stress{path:path}", tags=["Drought Stress"])
-async def get_drought_stress_prediction(path: str = None):
+async def get_drought_stress_prediction(
+    path: str = None, latitude: float = LatitudeQuery, longitude: float = LongitudeQuery
+):
     try:
         today = datetime.today().strftime("%Y-%m-%d")
-        lat = c.SORRISO_LATITUDE
-        lon = c.SORRISO_LONGITUDE
+        lat, lon = location_key(latitude, longitude)
 
         weather_forecast_df = await retrieve_all_forecast_data(lat, lon, today)
-        return predict_drought_stress(weather_forecast_df)
+        return await predict_drought_stress(lat, lon, weather_forecast_df)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to predict drought stress: {str(e)}"
         )
 
 
+@app.post("/api/predict/batch", tags=["Batch Prediction"])
+async def get_batch_prediction(request: BatchPredictionRequest):
+    unknown_crops = {item.crop for item in request.items if item.crop.lower() not in crops.CROPS}
+    if unknown_crops:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Unknown crops: {sorted(unknown_crops)}"
+        )
+
+    try:
+        today = datetime.today().strftime("%Y-%m-%d")
+        items = [(item.crop.lower(), *location_key(item.latitude, item.longitude)) for item in request.items]
+
+        # Retrieve the forecast and the history of the distinct locations, a few at a time so that a large batch does
+        # not take all the connections to the forecast API
+        semaphore = asyncio.Semaphore(c.BATCH_PREDICTION_CONCURRENT_LOCATIONS)
+
+        async def load_location(latitude: float, longitude: float):
+            async with semaphore:
+                forecast_df = await retrieve_all_forecast_data(latitude, longitude, today)
+                store = await load_historical_weather_store(latitude, longitude)
+                return store, forecast_df
+
+        locations = list(dict.fromkeys((lat, lon) for _, lat, lon in items))
+        results = await asyncio.gather(*(load_location(lat, lon) for lat, lon in locations), return_exceptions=True)
+
+        # A location that failed only gives an error for its own items
+        loaded = {}
+        errors = {}
+        for location, result in zip(locations, results):
+            if isinstance(result, Exception):
+                errors[location] = result
+            else:
+                loaded[location] = result
+        valid_items = [(crop, lat, lon) for crop, lat, lon in items if (lat, lon) in loaded]
+
+        temp_stress = await run_inference(
+            predict_temperature_stress_batch, [(crop, lat, lon, *loaded[(lat, lon)]) for crop, lat, lon in valid_items]
+        )
+        drought_stress = await run_inference(predict_drought_stress_batch, list(loaded.values()))
+        temp_by_item = dict(zip(valid_items, temp_stress))
+        drought_by_location = dict(zip(loaded, drought_stress))
+
+        predictions = []
+        for crop, lat, lon in items:
+            prediction = {"coordinates": {"latitude": lat, "longitude": lon}, "crop": crop}
+            error = errors.get((lat, lon))
+            if error is None:
+                for result in (temp_by_item[(crop, lat, lon)], drought_by_location[(lat, lon)]):
+                    if isinstance(result, Exception):
+                        error = result
+            if error is None:
+                prediction["temp_stress"] = temp_by_item[(crop, lat, lon)]
+                prediction["drought_stress"] = drought_by_location[(lat, lon)]
+            else:
+                prediction["error"] = error.detail if isinstance(error, HTTPException) else str(error)
+            predictions.append(prediction)
+
+        return {"timestamp": datetime.now().isoformat(), "predictions": predictions}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to predict batch: {str(e)}"
+        )
+
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host=c.HOST, port=c.PORT, reload=c.DEBUG_MODE)
+    uvicorn.run("main:app", host=c.HOST, port=c.PORT, reload=c.DEBUG_MODE, workers=c.WORKERS)
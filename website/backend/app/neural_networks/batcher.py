@@ -0,0 +1,65 @@
+import asyncio
+import numpy as np
+from typing import Callable, Optional
+
+import config as c
+from neural_networks.inference_pool import run_inference
+
+
+class InferenceBatcher:
+    """
+    Collects the inputs of concurrent predictions for a model and runs them in a single batched forward pass.
+
+    A batch is run when it reaches max_batch_size inputs or max_wait_ms after its first input, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        forward: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: int = c.INFERENCE_MAX_BATCH_SIZE,
+        max_wait_ms: float = c.INFERENCE_MAX_WAIT_MS,
+    ):
+        self.forward = forward  # Maps inputs stacked on the first axis to outputs in the same order
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+
+        self._pending: list[tuple[np.ndarray, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._running: set[asyncio.Task] = set()  # Keep a reference to the running batches
+
+    async def predict(self, features: np.ndarray) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((features, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait_seconds, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: list[tuple[np.ndarray, asyncio.Future]]):
+        try:
+            outputs = await run_inference(self.forward, np.stack([features for features, _ in batch]))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Callers that gave up in the meantime are skipped
+        for output, (_, future) in zip(outputs, batch):
+            if not future.done():
+                future.set_result(output)
@@ -0,0 +1,67 @@
+import threading
+import numpy as np
+from typing import Hashable, Optional
+
+
+class TemperatureFeatureBuffer:
+    """
+    Input of the temperature stress models for one location, as a contiguous float32 array: the maximum and minimum
+    temperatures of each day, alternated, for the history days then the forecast days.
+
+    The history is written once per day, the requests only write the forecast days. The arrays given out are never
+    modified afterwards (they may still be waiting in a batch), a new one is filled when the history or the forecast
+    changes and requests with the same forecast share it.
+    """
+
+    def __init__(self, history_days: int, forecast_days: int):
+        self.history_days = history_days
+        self.forecast_days = forecast_days
+        self.size = 2 * (history_days + forecast_days)
+
+        self.features: Optional[np.ndarray] = None
+        self.history_key: Optional[Hashable] = None  # Identifies the history written in the features
+        self.lock = threading.Lock()
+
+    def get(
+        self, history_key: Hashable, temp_max: np.ndarray, temp_min: np.ndarray, forecast: np.ndarray
+    ) -> np.ndarray:
+        """
+        Args:
+            history_key: Changes whenever the history changes (new day or new data)
+            temp_max: Maximum temperatures of the history days
+            temp_min: Minimum temperatures of the history days
+            forecast: Maximum and minimum temperatures of the forecast days, shaped (forecast days, 2)
+
+        Returns:
+            Read-only array of the features
+        """
+        if len(temp_max) != self.history_days or len(temp_min) != self.history_days:
+            raise ValueError(
+                f"Temperature stress features need {self.history_days} days of history, "
+                f"got {len(temp_max)} maximum and {len(temp_min)} minimum temperatures"
+            )
+        if forecast.shape != (self.forecast_days, 2):
+            raise ValueError(
+                f"Temperature stress features need {self.forecast_days} forecast days of maximum and minimum "
+                f"temperatures, got an array shaped {forecast.shape}"
+            )
+
+        history_size = 2 * self.history_days
+        with self.lock:
+            features = self.features
+            same_history = features is not None and self.history_key == history_key
+            if same_history and np.array_equal(features[history_size:], forecast.reshape(-1), equal_nan=True):
+                return features
+
+            new_features = np.empty(self.size, dtype=np.float32)
+            if same_history:
+                new_features[:history_size] = features[:history_size]
+            else:
+                new_features[0:history_size:2] = temp_max
+                new_features[1:history_size:2] = temp_min
+            new_features[history_size:] = forecast.reshape(-1)
+            new_features.flags.writeable = False
+
+            self.features = new_features
+            self.history_key = history_key
+            return new_features
@@ -0,0 +1,15 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import config as c
+
+# Predictions run in these threads, so that the event loop keeps serving the requests waiting for the network
+inference_executor = ThreadPoolExecutor(max_workers=c.INFERENCE_WORKERS, thread_name_prefix="inference")
+
+
+async def run_inference(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(inference_executor, function, *args)
+
+
+def shutdown_inference_pool():
+    inference_executor.shutdown(wait=False, cancel_futures=True)
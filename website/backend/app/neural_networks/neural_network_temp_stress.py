@@ -28,3 +28,40 @@ class NN_temp_stress(nn.Module):
 
     def load(self, path):
         torch.load_state_dict(torch.load(path))
+
+
+class NN_temp_stress_fused(nn.Module):
+    """
+    Several NN_temp_stress models (one per crop) run together on the same input.
+
+    The first layers are concatenated into a single Linear, the next ones are stacked and applied with batched matmuls.
+    Returns the outputs of every model, shaped (batch, models, output_size).
+    """
+
+    def __init__(self, models: list[NN_temp_stress]):
+        super(NN_temp_stress_fused, self).__init__()
+        self.num_models = len(models)
+        self.hidden_size = models[0].fc1.out_features
+
+        with torch.no_grad():
+            self.fc1 = nn.Linear(models[0].fc1.in_features, self.num_models * self.hidden_size)
+            self.fc1.weight.copy_(torch.cat([model.fc1.weight for model in models]))
+            self.fc1.bias.copy_(torch.cat([model.fc1.bias for model in models]))
+
+            # Weights transposed to (models, in, out) and biases to (models, 1, out), as used by baddbmm
+            self.fc2_weight = nn.Parameter(torch.stack([model.fc2.weight.T for model in models]).contiguous())
+            self.fc2_bias = nn.Parameter(torch.stack([model.fc2.bias.unsqueeze(0) for model in models]))
+            self.fc3_weight = nn.Parameter(torch.stack([model.fc3.weight.T for model in models]).contiguous())
+            self.fc3_bias = nn.Parameter(torch.stack([model.fc3.bias.unsqueeze(0) for model in models]))
+
+        self.to(models[0].fc1.weight.device)
+
+    def forward(self, state):
+        single = state.dim() == 1
+        x = state.reshape(-1, state.shape[-1])
+        x = torch.relu(self.fc1(x))
+        x = x.view(-1, self.num_models, self.hidden_size).transpose(0, 1)  # (models, batch, hidden)
+        x = torch.relu(torch.baddbmm(self.fc2_bias, x, self.fc2_weight))
+        x = torch.sigmoid(torch.baddbmm(self.fc3_bias, x, self.fc3_weight))
+        x = x.transpose(0, 1)  # (batch, models, output)
+        return x[0] if single else x
@@ -0,0 +1,115 @@
+import pickle
+import zipfile
+import collections
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+# Element types of the tensor storages that can be found in the state dicts
+STORAGE_DTYPES = {
+    "FloatStorage": np.float32,
+    "DoubleStorage": np.float64,
+    "HalfStorage": np.float16,
+    "LongStorage": np.int64,
+    "IntStorage": np.int32,
+}
+
+
+def _rebuild_tensor(storage, storage_offset, size, stride, *args):
+    # Same signature as torch._utils._rebuild_tensor_v2, strides are in elements
+    strides = [step * storage.itemsize for step in stride]
+    return np.lib.stride_tricks.as_strided(storage[storage_offset:], shape=size, strides=strides).copy()
+
+
+class _StateDictUnpickler(pickle.Unpickler):
+    # Only rebuilds the tensors of a state dict, any other object in the file is refused
+
+    def __init__(self, archive: zipfile.ZipFile, prefix: str, byteorder: str):
+        super().__init__(archive.open(prefix + "data.pkl"))
+        self.archive = archive
+        self.prefix = prefix
+        self.byteorder = byteorder
+
+    def find_class(self, module, name):
+        if (module, name) == ("collections", "OrderedDict"):
+            return collections.OrderedDict
+        if (module, name) == ("torch._utils", "_rebuild_tensor_v2"):
+            return _rebuild_tensor
+        if module == "torch" and name in STORAGE_DTYPES:
+            return np.dtype(STORAGE_DTYPES[name]).newbyteorder("<" if self.byteorder == "little" else ">")
+        raise pickle.UnpicklingError(f"Unsupported object in the state dict: {module}.{name}")
+
+    def persistent_load(self, pid):
+        # ("storage", storage type, key, location, number of elements)
+        _, dtype, key, _, num_elements = pid
+        data = self.archive.read(f"{self.prefix}data/{key}")
+        return np.frombuffer(data, dtype=dtype, count=num_elements).astype(dtype.newbyteorder("="))
+
+
+def limit_blas_threads(num_threads: int) -> None:
+    # The matmuls run in the inference threads, each one would otherwise use as many BLAS threads as there are cores
+    threadpool_limits(num_threads, user_api="blas")
+
+
+def load_state_dict(path: str) -> dict[str, np.ndarray]:
+    """
+    Read a state dict saved by torch.save (zip format) as NumPy arrays, without PyTorch.
+    """
+    with zipfile.ZipFile(path) as archive:
+        pickle_name = next(name for name in archive.namelist() if name.endswith("data.pkl"))
+        prefix = pickle_name[: -len("data.pkl")]
+        names = archive.namelist()
+        byteorder = archive.read(prefix + "byteorder").decode() if prefix + "byteorder" in names else "little"
+        return dict(_StateDictUnpickler(archive, prefix, byteorder).load())
+
+
+def _relu(x: np.ndarray) -> np.ndarray:
+    return np.maximum(x, 0, out=x)
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    with np.errstate(over="ignore"):  # exp overflows to inf for very negative inputs, giving 0 as expected
+        return 1 / (1 + np.exp(-x))
+
+
+class NumpyMLP:
+    """
+    Evaluation of NN_temp_stress and NN_drought_stress (Linear layers with ReLU, then Sigmoid) with NumPy matmuls.
+    """
+
+    def __init__(self, state_dict: dict[str, np.ndarray], layers: tuple[str, ...] = ("fc1", "fc2", "fc3")):
+        # Weights transposed once, so that inputs stacked on the first axis are multiplied directly
+        self.weights = [np.ascontiguousarray(state_dict[f"{layer}.weight"].T) for layer in layers]
+        self.biases = [state_dict[f"{layer}.bias"] for layer in layers]
+
+    def __call__(self, features: np.ndarray) -> np.ndarray:
+        x = features
+        for weight, bias in zip(self.weights[:-1], self.biases[:-1]):
+            x = _relu(x @ weight + bias)
+        return _sigmoid(x @ self.weights[-1] + self.biases[-1])
+
+
+class NumpyFusedMLP:
+    """
+    Several NumpyMLP run together on the same input, as NN_temp_stress_fused.
+
+    Returns the outputs of every model, shaped (batch, models, output_size).
+    """
+
+    def __init__(self, models: list[NumpyMLP]):
+        self.num_models = len(models)
+        self.fc1_weight = np.concatenate([model.weights[0] for model in models], axis=1)
+        self.fc1_bias = np.concatenate([model.biases[0] for model in models])
+        self.hidden_size = models[0].weights[0].shape[1]
+
+        # Stacked to (models, in, out) and (models, 1, out) for the batched matmuls
+        self.weights = [np.stack([model.weights[i] for model in models]) for i in range(1, len(models[0].weights))]
+        self.biases = [np.stack([model.biases[i][None] for model in models]) for i in range(1, len(models[0].biases))]
+
+    def __call__(self, features: np.ndarray) -> np.ndarray:
+        single = features.ndim == 1
+        x = _relu(features.reshape(-1, features.shape[-1]) @ self.fc1_weight + self.fc1_bias)
+        x = x.reshape(-1, self.num_models, self.hidden_size).transpose(1, 0, 2)  # (models, batch, hidden)
+        for weight, bias in zip(self.weights[:-1], self.biases[:-1]):
+            x = _relu(x @ weight + bias)
+        x = _sigmoid(x @ self.weights[-1] + self.biases[-1]).transpose(1, 0, 2)  # (batch, models, output)
+        return x[0] if single else x
@@ -0,0 +1,20 @@
+import numpy as np
+
+import config as c
+
+
+class OnnxModel:
+    """
+    ONNX Runtime session called like the other models, with inputs stacked on the first axis.
+    """
+
+    def __init__(self, path: str):
+        import onnxruntime  # Optional dependency, only needed for the ONNX models
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = c.INFERENCE_NUM_THREADS
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, features: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: features})[0]
@@ -1,48 +1,77 @@
-import torch
 import math
+import asyncio
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
+from functools import partial
 
 import config as c
-from util.load_resources import GlobalResources
-from util.timed_cache import TimedCache, cached, CacheCategory
-
-
-@cached(TimedCache(), category=CacheCategory.DB_DATA, ttl_seconds=12 * 3600)
-def get_historical_weather_last_days(num_days: int) -> pd.DataFrame:
+import crops
+from util.load_resources import GlobalResources, TORCH_MODEL_FORMATS
+from util.historical_store import HistoricalWeatherStore
+from util.timed_cache import cached, CacheCategory
+from util.cache_backends import get_cache_backend
+from neural_networks.batcher import InferenceBatcher
+from neural_networks.inference_pool import run_inference
+
+
+async def load_historical_weather_store(latitude: float, longitude: float) -> HistoricalWeatherStore:
+    # Fetching the history of a new location or its missing days blocks on the API, it is done in a thread of the
+    # default executor so that the inference pool only runs CPU work
     resources = GlobalResources()
-    historical_df = resources.get_historical_weather_df()
-
-    current_date = datetime.now()
-    date_n_days_ago = current_date - timedelta(days=(num_days + 1))  # All dates start at midnight
-
-    return historical_df.loc[historical_df["date"] >= date_n_days_ago]
+    store = resources.get_loaded_historical_weather_store(latitude, longitude)
+    if store is None:
+        store = await asyncio.to_thread(resources.get_historical_weather_store, latitude, longitude)
+    return store
+
+
+def build_temperature_stress_features(
+    latitude: float, longitude: float, store: HistoricalWeatherStore, forecast_df: pd.DataFrame
+) -> np.ndarray:
+    # Views over the memory-mapped history, from 2 years ago until yesterday. The version is read first, a write in
+    # between only makes the next request copy the history again
+    today = np.datetime64(datetime.now().date(), "D")
+    history_version = store.version
+    historical_data = store.window(today - c.NUM_DAYS_TEMP_STRESS_PREDICTION, today - 1)
+    forecast_features = np.stack(
+        [forecast_df[column].to_numpy(dtype=np.float32) for column in ["temp_max", "temp_min"]]
+    )
+
+    # The history is only copied in the features when it changes (new day, new or replaced data)
+    feature_buffer = GlobalResources().get_temperature_feature_buffer(latitude, longitude)
+    return feature_buffer.get(
+        (today, *history_version),
+        historical_data["temp_max"],
+        historical_data["temp_min"],
+        forecast_features.T,
+    )
+
+
+def build_drought_stress_features(store: HistoricalWeatherStore, forecast_df: pd.DataFrame) -> np.ndarray:
+    f_evaporation_sum = forecast_df["evaporation_sum"].sum()
+    f_rainfall_sum = forecast_df["rainfall_sum"].sum()
+    f_soil_moisture_avg = forecast_df["soil_moisture_avg"].mean()
+    f_temp_avg = forecast_df["temp_avg"].mean()
 
+    forecast_data_parameters = [f_evaporation_sum, f_rainfall_sum, f_soil_moisture_avg, f_temp_avg]
 
-@cached(TimedCache(), category=CacheCategory.TEMP_STRESS_PREDICTION, ttl_seconds=12 * 3600)
-def predict_temperature_stress(crop: str, forecast_df: pd.DataFrame) -> torch.Tensor:
-    # Get historical data
-    historical_data = get_historical_weather_last_days(c.NUM_DAYS_TEMP_STRESS_PREDICTION)
-    combined_data = pd.concat([historical_data, forecast_df], ignore_index=True)
+    # Aggregates of the history from the prefix sums of the store (missing days are skipped)
+    today = np.datetime64(datetime.now().date(), "D")
+    first_day, last_day = today - c.NUM_DAYS_DROUGHT_STRESS_PREDICTION, today - 1
+    historical_sums = store.window_sums(first_day, last_day)
+    historical_means = store.window_means(first_day, last_day)
 
-    resources = GlobalResources()
-    temp_stress_model = resources.get_temp_stress_model(crop)
+    h_evaporation_sum = historical_sums["evaporation_sum"]
+    h_rainfall_sum = historical_sums["rainfall_sum"]
+    h_soil_moisture_avg = historical_means["soil_moisture_avg"]
+    h_temp_avg = historical_means["temp_avg"]
 
-    # Extract features required by the model
-    feature_columns = ["temp_max", "temp_min"]
-    features = combined_data[feature_columns].to_numpy()
-    features_tensor = torch.tensor(features, dtype=torch.float32)
-    features_tensor_flat = features_tensor.reshape(-1)  # Alternate max and min
+    historical_data_parameters = [h_evaporation_sum, h_rainfall_sum, h_soil_moisture_avg, h_temp_avg]
 
-    # Ensure tensor is on the same device as the model
-    device = next(temp_stress_model.parameters()).device
-    features_tensor_flat = features_tensor_flat.to(device)
+    return np.array(forecast_data_parameters + historical_data_parameters, dtype=np.float32)
 
-    # Predict temperature stress
-    with torch.no_grad():
-        stress_predictions = temp_stress_model(features_tensor_flat)
 
+def format_temperature_stress(stress_predictions: np.ndarray) -> dict:
     # The output tensor contains 3 values of stress for each of the 12 following weeks
     stress_data = {}
     for week in range(1, 13):
@@ -63,48 +92,152 @@ def predict_temperature_stress(crop: str, forecast_df: pd.DataFrame) -> torch.Te
     return stress_data
 
 
-@cached(TimedCache(), category=CacheCategory.DROUGHT_STRESS_PREDICTION, ttl_seconds=12 * 3600)
-def predict_drought_stress(forecast_df: pd.DataFrame) -> torch.Tensor:
-    f_evaporation_sum = forecast_df["evaporation_sum"].sum()
-    f_rainfall_sum = forecast_df["rainfall_sum"].sum()
-    f_soil_moisture_avg = forecast_df["soil_moisture_avg"].mean()
-    f_temp_avg = forecast_df["temp_avg"].mean()
+def format_drought_stress(stress_predictions: np.ndarray) -> dict:
+    # The output tensor contains 1 value for the drought index for each of the 12 following weeks
+    stress_data = {}
+    for week in range(1, 13):
+        week_index = week - 1
 
-    forecast_data_parameters = [f_evaporation_sum, f_rainfall_sum, f_soil_moisture_avg, f_temp_avg]
+        drought_stress = math.floor(stress_predictions[week_index] * 10)
 
-    # Get historical data
-    historical_data = get_historical_weather_last_days(c.NUM_DAYS_DROUGHT_STRESS_PREDICTION)
+        stress_data[f"week_{week}"] = {
+            "drought_stress": drought_stress,
+        }
 
-    h_evaporation_sum = historical_data["evaporation_sum"].sum()
-    h_rainfall_sum = historical_data["rainfall_sum"].sum()
-    h_soil_moisture_avg = historical_data["soil_moisture_avg"].mean()
-    h_temp_avg = historical_data["temp_avg"].mean()
+    return stress_data
 
-    historical_data_parameters = [h_evaporation_sum, h_rainfall_sum, h_soil_moisture_avg, h_temp_avg]
 
-    resources = GlobalResources()
-    drought_stress_model = resources.get_drought_stress_model()
+def run_model(model, features: np.ndarray) -> np.ndarray:
+    if c.MODEL_FORMAT not in TORCH_MODEL_FORMATS:
+        return model(features)
+
+    from neural_networks.torch_models import run_torch_model  # PyTorch is only imported when it runs the models
+
+    return run_torch_model(model, features, GlobalResources().device)
+
+
+def run_temp_stress_model(crop: str, features: np.ndarray) -> np.ndarray:
+    return run_model(GlobalResources().get_temp_stress_model(crop), features)
+
+
+def run_fused_temp_stress_model(features: np.ndarray) -> np.ndarray:
+    return run_model(GlobalResources().get_fused_temp_stress_model(), features)
+
+
+def run_drought_stress_model(features: np.ndarray) -> np.ndarray:
+    return run_model(GlobalResources().get_drought_stress_model(), features)
+
+
+# Concurrent predictions of each model are batched together
+temp_stress_batchers = {crop: InferenceBatcher(partial(run_temp_stress_model, crop)) for crop in crops.CROPS}
+fused_temp_stress_batcher = InferenceBatcher(run_fused_temp_stress_model)
+drought_stress_batcher = InferenceBatcher(run_drought_stress_model)
 
-    features = np.array([forecast_data_parameters + historical_data_parameters])
-    features_tensor = torch.from_numpy(features).float()
 
-    # Ensure tensor is on the same device as the model
-    device = next(drought_stress_model.parameters()).device
-    features_tensor = features_tensor.to(device)
+@cached(get_cache_backend(), category=CacheCategory.TEMP_STRESS_PREDICTION, ttl_seconds=12 * 3600)
+async def predict_temperature_stress(crop: str, latitude: float, longitude: float, forecast_df: pd.DataFrame) -> dict:
+    batcher = temp_stress_batchers[crop]
+    store = await load_historical_weather_store(latitude, longitude)
+    features = await run_inference(build_temperature_stress_features, latitude, longitude, store, forecast_df)
 
     # Predict temperature stress
-    with torch.no_grad():
-        stress_predictions = drought_stress_model(features_tensor)
+    stress_predictions = await batcher.predict(features)
+    return format_temperature_stress(stress_predictions)
+
+
+@cached(get_cache_backend(), category=CacheCategory.TEMP_STRESS_PREDICTION, ttl_seconds=12 * 3600)
+async def predict_temperature_stress_all_crops(latitude: float, longitude: float, forecast_df: pd.DataFrame) -> dict:
+    if not c.TEMP_STRESS_FUSED:
+        stress_data = await asyncio.gather(
+            *(predict_temperature_stress(crop, latitude, longitude, forecast_df) for crop in crops.CROPS)
+        )
+        return dict(zip(crops.CROPS, stress_data))
+
+    store = await load_historical_weather_store(latitude, longitude)
+    features = await run_inference(build_temperature_stress_features, latitude, longitude, store, forecast_df)
+
+    # Predict the temperature stress of every crop in a single pass
+    stress_predictions = await fused_temp_stress_batcher.predict(features)
+    return {crop: format_temperature_stress(stress_predictions[i]) for i, crop in enumerate(crops.CROPS)}
+
+
+@cached(get_cache_backend(), category=CacheCategory.DROUGHT_STRESS_PREDICTION, ttl_seconds=12 * 3600)
+async def predict_drought_stress(latitude: float, longitude: float, forecast_df: pd.DataFrame) -> dict:
+    store = await load_historical_weather_store(latitude, longitude)
+    features = await run_inference(build_drought_stress_features, store, forecast_df)
+
+    # Predict drought stress
+    stress_predictions = await drought_stress_batcher.predict(features)
+    return format_drought_stress(stress_predictions)
+
+
+def predict_temperature_stress_batch(
+    items: list[tuple[str, float, float, HistoricalWeatherStore, pd.DataFrame]],
+) -> list[dict | Exception]:
+    # Features only depend on the location, so they are built once even if several crops are requested. The items of
+    # a location whose features can not be built get the exception instead of a prediction
+    features_by_location = {}
+    errors_by_location = {}
+    indices_by_crop: dict[str, list[int]] = {}
+    stress_data = [None] * len(items)
+    for i, (crop, latitude, longitude, store, forecast_df) in enumerate(items):
+        location = (latitude, longitude)
+        if location not in features_by_location and location not in errors_by_location:
+            try:
+                features_by_location[location] = build_temperature_stress_features(
+                    latitude, longitude, store, forecast_df
+                )
+            except Exception as e:
+                errors_by_location[location] = e
+        if location in errors_by_location:
+            stress_data[i] = errors_by_location[location]
+        else:
+            indices_by_crop.setdefault(crop, []).append(i)
+
+    if not features_by_location:
+        return stress_data
+    resources = GlobalResources()
 
-    # The output tensor contains 1 value for the drought index for each of the 12 following weeks
-    stress_data = {}
-    for week in range(1, 13):
-        week_index = week - 1
+    if c.TEMP_STRESS_FUSED and len(indices_by_crop) > 1:
+        # One forward pass of the fused model for all the requested locations, giving every crop at once
+        features = np.stack(list(features_by_location.values()))
+        stress_predictions = run_model(resources.get_fused_temp_stress_model(), features)
 
-        drought_stress = math.floor(stress_predictions[0][week_index] * 10)
+        location_rows = {location: row for row, location in enumerate(features_by_location)}
+        crop_columns = {crop: column for column, crop in enumerate(crops.CROPS)}
+        for i, (crop, latitude, longitude, _, _) in enumerate(items):
+            if (latitude, longitude) in errors_by_location:
+                continue
+            prediction = stress_predictions[location_rows[(latitude, longitude)], crop_columns[crop]]
+            stress_data[i] = format_temperature_stress(prediction)
+        return stress_data
+
+    # One forward pass for each crop model with all the requested locations stacked
+    for crop, indices in indices_by_crop.items():
+        features = np.stack([features_by_location[(items[i][1], items[i][2])] for i in indices])
+        stress_predictions = run_model(resources.get_temp_stress_model(crop), features)
+
+        for row, i in enumerate(indices):
+            stress_data[i] = format_temperature_stress(stress_predictions[row])
+
+    return stress_data
 
-        stress_data[f"week_{week}"] = {
-            "drought_stress": drought_stress,
-        }
 
+def predict_drought_stress_batch(items: list[tuple[HistoricalWeatherStore, pd.DataFrame]]) -> list[dict | Exception]:
+    # The items whose features can not be built get the exception instead of a prediction
+    stress_data = [None] * len(items)
+    features = []
+    indices = []
+    for i, item in enumerate(items):
+        try:
+            features.append(build_drought_stress_features(*item))
+            indices.append(i)
+        except Exception as e:
+            stress_data[i] = e
+
+    if features:
+        resources = GlobalResources()
+        stress_predictions = run_model(resources.get_drought_stress_model(), np.stack(features))
+        for i, row in zip(indices, stress_predictions):
+            stress_data[i] = format_drought_stress(row)
     return stress_data
@@ -0,0 +1,38 @@
+import torch
+import numpy as np
+
+import config as c
+from neural_networks.neural_network_temp_stress import NN_temp_stress
+from neural_networks.neural_network_drought_stress import NN_drought_stress
+
+
+def setup_torch(model_format: str) -> torch.device:
+    # Exported models only run on CPU
+    torch.set_num_threads(c.INFERENCE_NUM_THREADS)
+    return torch.device("cuda" if torch.cuda.is_available() and model_format == "eager" else "cpu")
+
+
+def load_temp_stress_model(crop: str, device: torch.device) -> NN_temp_stress:
+    model = NN_temp_stress(c.TEMP_STRESS_INPUT_SIZE, c.TEMP_STRESS_OUTPUT_SIZE, device).to(device)
+    model_state_dict = torch.load(c.TEMP_STRESS_MODEL_PATH_TEMPLATE.format(crop), map_location=device)
+    model.load_state_dict(model_state_dict)
+    return model.eval()
+
+
+def load_drought_stress_model(device: torch.device) -> NN_drought_stress:
+    d_model = NN_drought_stress(c.DROUGHT_STRESS_INPUT_SIZE, c.DROUGHT_STRESS_OUTPUT_SIZE, device).to(device)
+    d_model_state_dict = torch.load(c.DROUGHT_STRESS_MODEL_PATH_TEMPLATE, map_location=device)
+    d_model.load_state_dict(d_model_state_dict)
+    return d_model.eval()
+
+
+def load_torchscript_model(path: str) -> torch.jit.ScriptModule:
+    return torch.jit.load(path, map_location="cpu").eval()
+
+
+def run_torch_model(model: torch.nn.Module, features: np.ndarray, device: torch.device) -> np.ndarray:
+    # Ensure tensor is on the same device as the model
+    features_tensor = torch.from_numpy(features).to(device)
+
+    with torch.no_grad():
+        return model(features_tensor).cpu().numpy()
@@ -4,9 +4,11 @@ import pandas as pd
 from datetime import datetime
 from fastapi import HTTPException
 from enum import Enum
+from typing import Optional
 
 import config as c
-from util.timed_cache import TimedCache, cached, CacheCategory
+from util.timed_cache import cached, CacheCategory
+from util.cache_backends import get_forecast_cache_backend
 
 
 class MeasureLabel(Enum):
@@ -18,29 +20,57 @@ class MeasureLabel(Enum):
     SOIL_MOISTURE_AVG = "Soilmoisture_0to10cm_DailyAvg (vol%)"
 
 
+# Client shared by all the forecast requests for the lifetime of the application, so that connections are reused
+http_client: Optional[httpx.AsyncClient] = None
+
+
+async def open_http_client() -> httpx.AsyncClient:
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            http2=c.FORECAST_HTTP2,
+            limits=httpx.Limits(
+                max_connections=c.FORECAST_MAX_CONNECTIONS,
+                max_keepalive_connections=c.FORECAST_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=c.FORECAST_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=httpx.Timeout(c.FORECAST_TIMEOUT_SECONDS, connect=c.FORECAST_CONNECT_TIMEOUT_SECONDS),
+        )
+    return http_client
+
+
+async def close_http_client() -> None:
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+
 async def retrieve_forecast_label(latitude: float, longitude: float, start_date: str, measure_label: MeasureLabel):
+    client = await open_http_client()  # Already opened at startup, opened here only outside of the application
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                c.FORECAST_API_URL,
-                params={
-                    "latitude": latitude,
-                    "longitude": longitude,
-                    "startDate": start_date,
-                    "supplier": c.FORECAST_SUPPLIER,
-                    "measureLabel": measure_label,
-                    "top": c.FORECAST_DAYS,
-                    "format": "json",
-                },
-                headers={"accept": "*/*", "ApiKey": c.FORECAST_API_KEY},
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await client.get(
+            c.FORECAST_API_URL,
+            params={
+                "latitude": latitude,
+                "longitude": longitude,
+                "startDate": start_date,
+                "supplier": c.FORECAST_SUPPLIER,
+                "measureLabel": measure_label,
+                "top": c.FORECAST_DAYS,
+                "format": "json",
+            },
+            headers={"accept": "*/*", "ApiKey": c.FORECAST_API_KEY},
+        )
+        response.raise_for_status()
+        return response.json()
     except httpx.HTTPStatusError as e:
         raise HTTPException(status_code=e.response.status_code, detail=str(e))
+    except httpx.TimeoutException as e:
+        raise HTTPException(status_code=504, detail=f"Forecast API timed out: {str(e)}")
 
 
-@cached(TimedCache(), category=CacheCategory.WEATHER_FORECAST, ttl_seconds=3600)
+@cached(get_forecast_cache_backend(), category=CacheCategory.WEATHER_FORECAST, ttl_seconds=3600, stale_seconds=900)
 async def retrieve_all_forecast_data(latitude: float, longitude: float, start_date: str):
     retrieve_tasks = []
 
@@ -0,0 +1,40 @@
+"""
+Prefix sums of daily values, shared by the backend history and the training data generator.
+
+prefix[i] holds the sum of the values before index i and how many of them are present (missing values are NaN and
+skipped), so the sum, count and mean of any window [start, stop) take O(1) whatever its length. Windows can be given
+as integers or as arrays of indices to aggregate many windows at once.
+"""
+
+import numpy as np
+
+
+def prefix_sums(values: np.ndarray) -> np.ndarray:
+    # Shaped (len(values) + 1, 2): running sum, running count of the present values
+    return extend_prefix_sums(np.zeros(2), values, include_start=True)
+
+
+def extend_prefix_sums(last_prefix: np.ndarray, values: np.ndarray, include_start: bool = False) -> np.ndarray:
+    # Prefix sums of the values following the ones summed in last_prefix
+    values = np.asarray(values, dtype=np.float64)
+    present = ~np.isnan(values)
+    prefix = np.empty((len(values) + include_start, 2), dtype=np.float64)
+    prefix[include_start:, 0] = last_prefix[0] + np.cumsum(np.where(present, values, 0.0))
+    prefix[include_start:, 1] = last_prefix[1] + np.cumsum(present)
+    if include_start:
+        prefix[0] = last_prefix
+    return prefix
+
+
+def window_sum(prefix: np.ndarray, start, stop):
+    return prefix[stop, 0] - prefix[start, 0]
+
+
+def window_count(prefix: np.ndarray, start, stop):
+    return prefix[stop, 1] - prefix[start, 1]
+
+
+def window_mean(prefix: np.ndarray, start, stop):
+    # NaN when no value of the window is present
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.divide(window_sum(prefix, start, stop), window_count(prefix, start, stop))
@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import config as c
+import crops
+from util.load_resources import GlobalResources
+from util.cache_backends import get_cache_backend
+from util.timed_cache import CacheCategory
+from util.util import location_key
+from retrieve_forecast import retrieve_all_forecast_data
+from neural_networks.predict_stress import predict_temperature_stress, predict_drought_stress
+
+# Cached data computed from the historical weather, outdated after each refresh
+HISTORY_DEPENDENT_CATEGORIES = [
+    CacheCategory.DB_DATA,
+    CacheCategory.TEMP_STRESS_PREDICTION,
+    CacheCategory.DROUGHT_STRESS_PREDICTION,
+]
+
+
+def get_seconds_until_next_refresh(now: datetime) -> float:
+    hour, minute = map(int, c.HISTORICAL_REFRESH_TIME.split(":"))
+    next_refresh = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if next_refresh <= now:
+        next_refresh += timedelta(days=1)
+    return (next_refresh - now).total_seconds()
+
+
+async def prewarm_caches():
+    # Compute the forecasts and predictions of the configured locations, so that requests find them in the cache
+    today = datetime.today().strftime("%Y-%m-%d")
+    prewarm_crops = c.PREWARM_CROPS or crops.CROPS
+
+    # A few locations at a time, as the batch predictions, so that the forecast connections stay available
+    semaphore = asyncio.Semaphore(c.BATCH_PREDICTION_CONCURRENT_LOCATIONS)
+
+    async def prewarm_location(lat: float, lon: float):
+        async with semaphore:
+            try:
+                weather_forecast_df = await retrieve_all_forecast_data(lat, lon, today)
+                await asyncio.gather(
+                    *(predict_temperature_stress(crop, lat, lon, weather_forecast_df) for crop in prewarm_crops),
+                    predict_drought_stress(lat, lon, weather_forecast_df),
+                )
+            except Exception as e:
+                print(f"Error prewarming caches for ({lat}, {lon}): {str(e)}")
+
+    locations = dict.fromkeys(location_key(latitude, longitude) for latitude, longitude in c.PREWARM_LOCATIONS)
+    await asyncio.gather(*(prewarm_location(lat, lon) for lat, lon in locations))
+
+
+async def refresh_historical_weather():
+    # Fetch the new days for every loaded location, then recompute what depends on them
+    await asyncio.to_thread(GlobalResources().refresh_historical_weather)
+
+    cache_backend = get_cache_backend()
+    for category in HISTORY_DEPENDENT_CATEGORIES:
+        cache_backend.invalidate_category(category)
+
+    await prewarm_caches()
+
+
+async def run_scheduler():
+    if c.FAST_START:
+        # The history was loaded without the days missed while the server was down
+        try:
+            await asyncio.to_thread(
+                GlobalResources().get_historical_weather_store, c.SORRISO_LATITUDE, c.SORRISO_LONGITUDE, False
+            )
+            await refresh_historical_weather()
+        except Exception as e:
+            print(f"Error refreshing historical weather: {str(e)}")
+    else:
+        await prewarm_caches()
+
+    while True:
+        await asyncio.sleep(get_seconds_until_next_refresh(datetime.now()))
+        try:
+            await refresh_historical_weather()
+        except Exception as e:
+            print(f"Error refreshing historical weather: {str(e)}")
@@ -0,0 +1,13 @@
+from pydantic import BaseModel, Field
+
+import config as c
+
+
+class FieldCrop(BaseModel):
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+    crop: str
+
+
+class BatchPredictionRequest(BaseModel):
+    items: list[FieldCrop] = Field(min_length=1, max_length=c.MAX_BATCH_PREDICTION_ITEMS)
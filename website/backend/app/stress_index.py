@@ -0,0 +1,84 @@
+"""
+Vectorized temperature stress indices, shared by the backend and the training label generator.
+
+Every index goes from 0 (no stress) to 9 (maximum stress) for each day, the weekly index is the average over the week.
+The stress types are ordered as STRESS_TYPES along the stress axis of the returned arrays.
+"""
+
+import numpy as np
+
+from crops import CROPS, CROPS_TEMPERATURE_THRESHOLDS
+
+STRESS_TYPES = ["diurnal_heat", "frost", "nighttime_heat"]
+MAX_STRESS = 9
+
+THRESHOLD_NAMES = [
+    "temp_max_optimum",
+    "temp_max_limit",
+    "temp_min_optimum",
+    "temp_min_limit",
+    "temp_min_no_frost",
+    "temp_min_frost",
+]
+
+
+def get_thresholds(crops: list[str] = CROPS) -> np.ndarray:
+    # Thresholds shaped (crops, thresholds), ordered as THRESHOLD_NAMES. Crop names are case-insensitive.
+    return np.array(
+        [[CROPS_TEMPERATURE_THRESHOLDS[crop.lower()][name] for name in THRESHOLD_NAMES] for crop in crops],
+        dtype=np.float64,
+    )
+
+
+def get_num_weeks(num_days: int) -> int:
+    # Weeks start every 7 days and the last day is never the start of a week (85 days are 12 weeks)
+    return len(range(0, num_days - 7, 7))
+
+
+def daily_stress_indices(temp_max: np.ndarray, temp_min: np.ndarray, crops: list[str] = CROPS) -> np.ndarray:
+    """
+    Compute the stress indices of each day.
+
+    Args:
+        temp_max: Daily maximum temperatures shaped (..., days)
+        temp_min: Daily minimum temperatures shaped (..., days)
+        crops: Crops for which the stress is computed
+
+    Returns:
+        Array shaped (..., crops, stress types, days)
+    """
+    temp_max = np.asarray(temp_max, dtype=np.float64)[..., None, :]
+    temp_min = np.asarray(temp_min, dtype=np.float64)[..., None, :]
+    thresholds = get_thresholds(crops)[..., None]  # (crops, thresholds, 1) to broadcast over the days
+    max_optimum, max_limit, min_optimum, min_limit, min_no_frost, min_frost = np.moveaxis(thresholds, 1, 0)
+
+    # Linear between the optimum and the limit, maximum above the limit
+    diurnal_heat = MAX_STRESS * np.clip((temp_max - max_optimum) / (max_limit - max_optimum), 0, 1)
+    frost = MAX_STRESS * np.clip((temp_min - min_optimum) / (min_limit - min_optimum), 0, 1)
+
+    # Crops without frost thresholds (infinite) never get this stress, the invalid divisions are never selected
+    with np.errstate(invalid="ignore", divide="ignore"):
+        below_frost = MAX_STRESS * np.abs(min_frost - temp_min) / np.abs(min_frost - min_no_frost)
+    nighttime_heat = np.where(
+        temp_min >= min_no_frost, 0.0, np.where(temp_min < min_frost, below_frost, float(MAX_STRESS))
+    )
+
+    return np.stack([diurnal_heat, frost, nighttime_heat], axis=-2)
+
+
+def weekly_stress_indices(temp_max: np.ndarray, temp_min: np.ndarray, crops: list[str] = CROPS) -> np.ndarray:
+    """
+    Compute the average stress indices of each week, starting from the first day.
+
+    Args:
+        temp_max: Daily maximum temperatures shaped (..., days)
+        temp_min: Daily minimum temperatures shaped (..., days)
+        crops: Crops for which the stress is computed
+
+    Returns:
+        Array shaped (..., crops, stress types, weeks)
+    """
+    daily = daily_stress_indices(temp_max, temp_min, crops)
+    num_weeks = get_num_weeks(daily.shape[-1])
+    weeks = daily[..., : num_weeks * 7].reshape(*daily.shape[:-1], num_weeks, 7)
+    return weeks.mean(axis=-1)
@@ -0,0 +1,356 @@
+import io
+import os
+import time
+import uuid
+import sqlite3
+import threading
+import msgpack
+import pandas as pd
+from functools import cache
+from typing import Any, Optional
+
+import config as c
+from util.timed_cache import CacheBackend, CacheCategory, CacheEntry, TimedCache, get_fingerprint, set_fingerprint
+
+# Serialization of the cached values: Parquet for DataFrames, msgpack for plain containers. The shared backends can be
+# written by any process with access to them, so nothing is stored in a format that can run code when read (pickle)
+SERIALIZATION_FORMATS = ("parquet", "msgpack")
+
+
+def serialize(value: Any) -> tuple[str, bytes]:
+    if isinstance(value, pd.DataFrame):
+        buffer = io.BytesIO()
+        value.to_parquet(buffer, engine="pyarrow", compression="zstd")
+        return "parquet", buffer.getvalue()
+
+    if isinstance(value, (dict, list)):
+        try:
+            return "msgpack", msgpack.packb(value)
+        except (TypeError, ValueError, OverflowError) as e:
+            raise TypeError(f"Cached value is not made of basic types only: {e}") from e
+
+    raise TypeError(f"Values of type {type(value).__name__} cannot be stored in a shared cache")
+
+
+def deserialize(value_format: str, data: bytes) -> Any:
+    if value_format == "parquet":
+        return pd.read_parquet(io.BytesIO(data), engine="pyarrow")
+    elif value_format == "msgpack":
+        return msgpack.unpackb(data, strict_map_key=False)
+    raise ValueError(f"Unknown cache value format: {value_format}")
+
+
+def make_record(
+    value_format: str,
+    data: bytes,
+    fingerprint: Optional[str],
+    timestamp: float,
+    ttl: float,
+    stale_seconds: float,
+    category: Optional[str],
+) -> Optional[CacheEntry]:
+    if value_format not in SERIALIZATION_FORMATS:
+        return None  # Written by an older version (pickle), computed again
+
+    value = deserialize(value_format, data)
+
+    # Keep the fingerprint computed by the worker that produced the value, so all workers derive the same keys from it
+    if fingerprint:
+        set_fingerprint(value, fingerprint)
+
+    return CacheEntry(value, timestamp, ttl, stale_seconds, CacheCategory(category) if category else None, len(data))
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Cache stored in a local SQLite file, shared by all the workers running on the same machine.
+    """
+
+    CLEANUP_INTERVAL = 1000  # Expired entries are removed every this many writes
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._writes = 0
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex}"  # Identifies the locks taken by this process
+        self._local = threading.local()  # SQLite connections cannot be shared between threads
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        connection = self._connection()
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                format TEXT NOT NULL,
+                fingerprint TEXT,
+                created REAL NOT NULL,
+                ttl REAL NOT NULL,
+                stale_seconds REAL NOT NULL,
+                deadline REAL NOT NULL,
+                category TEXT
+            )
+            """)
+        connection.execute("CREATE INDEX IF NOT EXISTS cache_deadline ON cache (deadline)")
+        connection.execute("CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)  # Autocommit
+            connection.execute("PRAGMA journal_mode=WAL")  # Readers do not block the writer
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get_record(self, key: str) -> Optional[CacheEntry]:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT format, value, fingerprint, created, ttl, stale_seconds, category FROM cache "
+                "WHERE key = ? AND deadline > ?",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return make_record(*row) if row is not None else None
+
+    def set(
+        self,
+        key: str,
+        cached_value: Any,
+        ttl_seconds: int,
+        stale_seconds: int = 0,
+        category: Optional[CacheCategory] = None,
+        timestamp: Optional[float] = None,
+    ) -> None:
+        value_format, data = serialize(cached_value)
+        timestamp = time.time() if timestamp is None else timestamp
+
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                data,
+                value_format,
+                get_fingerprint(cached_value),
+                timestamp,
+                ttl_seconds,
+                stale_seconds,
+                timestamp + ttl_seconds + stale_seconds,
+                category.value if category else None,
+            ),
+        )
+
+        self._writes += 1
+        if self._writes % self.CLEANUP_INTERVAL == 0:
+            self.cleanup_expired()
+
+    def delete(self, key: str) -> bool:
+        return self._connection().execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount > 0
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM cache")
+
+    def cleanup_expired(self) -> int:
+        return self._connection().execute("DELETE FROM cache WHERE deadline <= ?", (time.time(),)).rowcount
+
+    def invalidate_category(self, category: CacheCategory) -> int:
+        return self._connection().execute("DELETE FROM cache WHERE category = ?", (category.value,)).rowcount
+
+    def try_lock(self, key: str, lease_seconds: float) -> bool:
+        # Take the lock if it is free or its lease expired (the holder crashed), in a single atomic statement
+        now = time.time()
+        cursor = self._connection().execute(
+            "INSERT INTO locks VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires = excluded.expires WHERE expires <= ?",
+            (key, self.owner, now + lease_seconds, now),
+        )
+        return cursor.rowcount > 0
+
+    def unlock(self, key: str) -> None:
+        self._connection().execute("DELETE FROM locks WHERE key = ? AND owner = ?", (key, self.owner))
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Cache stored in a Redis-protocol server, shared by all the workers on any machine.
+    """
+
+    KEY_PREFIX = "stress_buster:cache:"
+    LOCK_PREFIX = "stress_buster:lock:"
+    CATEGORY_PREFIX = "stress_buster:category:"  # Sets of the keys of each category
+
+    def __init__(self, url: str):
+        import redis  # Optional dependency, only needed for this backend
+
+        self.client = redis.Redis.from_url(url)
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+
+    def get_record(self, key: str) -> Optional[CacheEntry]:
+        fields = self.client.hgetall(self.KEY_PREFIX + key)
+        if not fields:
+            return None
+
+        record = make_record(
+            fields[b"format"].decode(),
+            fields[b"value"],
+            fields[b"fingerprint"].decode() or None,
+            float(fields[b"created"]),
+            float(fields[b"ttl"]),
+            float(fields[b"stale_seconds"]),
+            fields[b"category"].decode() or None,
+        )
+        return record if record is not None and time.time() < record.deadline else None
+
+    def set(
+        self,
+        key: str,
+        cached_value: Any,
+        ttl_seconds: int,
+        stale_seconds: int = 0,
+        category: Optional[CacheCategory] = None,
+        timestamp: Optional[float] = None,
+    ) -> None:
+        value_format, data = serialize(cached_value)
+        timestamp = time.time() if timestamp is None else timestamp
+        expire_milliseconds = int((timestamp + ttl_seconds + stale_seconds - time.time()) * 1000)
+        if expire_milliseconds <= 0:
+            return
+
+        # The server removes the entry once it cannot be served anymore
+        pipeline = self.client.pipeline()
+        pipeline.delete(self.KEY_PREFIX + key)
+        pipeline.hset(
+            self.KEY_PREFIX + key,
+            mapping={
+                "value": data,
+                "format": value_format,
+                "fingerprint": get_fingerprint(cached_value) or "",
+                "created": timestamp,
+                "ttl": ttl_seconds,
+                "stale_seconds": stale_seconds,
+                "category": category.value if category else "",
+            },
+        )
+        pipeline.pexpire(self.KEY_PREFIX + key, expire_milliseconds)
+        if category:
+            pipeline.sadd(self.CATEGORY_PREFIX + category.value, key)
+        pipeline.execute()
+
+    def delete(self, key: str) -> bool:
+        return self.client.delete(self.KEY_PREFIX + key) > 0
+
+    def clear(self) -> None:
+        for key in self.client.scan_iter(match=self.KEY_PREFIX + "*"):
+            self.client.delete(key)
+
+    def cleanup_expired(self) -> int:
+        return 0  # Expired entries are removed by the server
+
+    def invalidate_category(self, category: CacheCategory) -> int:
+        keys = self.client.smembers(self.CATEGORY_PREFIX + category.value)
+        self.client.delete(self.CATEGORY_PREFIX + category.value)
+        if not keys:
+            return 0
+        return self.client.delete(*(self.KEY_PREFIX.encode() + key for key in keys))
+
+    def try_lock(self, key: str, lease_seconds: float) -> bool:
+        return bool(self.client.set(self.LOCK_PREFIX + key, self.owner, nx=True, px=int(lease_seconds * 1000)))
+
+    def unlock(self, key: str) -> None:
+        if self.client.get(self.LOCK_PREFIX + key) == self.owner.encode():
+            self.client.delete(self.LOCK_PREFIX + key)
+
+
+class TieredCache(CacheBackend):
+    """
+    Fast cache in front of a shared or persistent one, values found only in the back are copied to the front when read.
+    """
+
+    def __init__(self, front: CacheBackend, back: CacheBackend):
+        self.front = front
+        self.back = back
+
+    def get_record(self, key: str) -> Optional[CacheEntry]:
+        # A stale local entry is served as is, the refresh started by the decorator looks for a fresher shared value
+        entry = self.front.get_record(key)
+        if entry is not None:
+            return entry
+        return self._copy_to_front(key)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self.front.get_record(key)
+        if entry is None or time.time() - entry.timestamp >= entry.ttl:
+            # Missing or stale locally, another worker may have stored a fresher value
+            entry = self._copy_to_front(key)
+            if entry is None or time.time() - entry.timestamp >= entry.ttl:
+                return None
+        return entry.value
+
+    def get_local_entry(self, key: str) -> Optional[tuple[Any, bool]]:
+        return self.front.get_local_entry(key)
+
+    def _copy_to_front(self, key: str) -> Optional[CacheEntry]:
+        shared_entry = self.back.get_record(key)
+        if shared_entry is not None:
+            self.front.set(
+                key,
+                shared_entry.value,
+                shared_entry.ttl,
+                shared_entry.stale_seconds,
+                shared_entry.category,
+                timestamp=shared_entry.timestamp,
+            )
+        return shared_entry
+
+    def set(
+        self,
+        key: str,
+        cached_value: Any,
+        ttl_seconds: int,
+        stale_seconds: int = 0,
+        category: Optional[CacheCategory] = None,
+        timestamp: Optional[float] = None,
+    ) -> None:
+        self.front.set(key, cached_value, ttl_seconds, stale_seconds, category, timestamp)
+        self.back.set(key, cached_value, ttl_seconds, stale_seconds, category, timestamp)
+
+    def delete(self, key: str) -> bool:
+        deleted_front = self.front.delete(key)
+        deleted_back = self.back.delete(key)
+        return deleted_front or deleted_back
+
+    def clear(self) -> None:
+        self.front.clear()
+        self.back.clear()
+
+    def cleanup_expired(self) -> int:
+        return self.front.cleanup_expired() + self.back.cleanup_expired()
+
+    def invalidate_category(self, category: CacheCategory) -> int:
+        return self.front.invalidate_category(category) + self.back.invalidate_category(category)
+
+    def try_lock(self, key: str, lease_seconds: float) -> bool:
+        return self.back.try_lock(key, lease_seconds)
+
+    def unlock(self, key: str) -> None:
+        self.back.unlock(key)
+
+
+@cache
+def get_cache_backend() -> CacheBackend:
+    # Backend used by the cached functions, selected in the configuration
+    if c.CACHE_BACKEND == "sqlite":
+        return TieredCache(TimedCache(), SQLiteCacheBackend(c.CACHE_SQLITE_PATH))
+    elif c.CACHE_BACKEND == "redis":
+        return TieredCache(TimedCache(), RedisCacheBackend(c.CACHE_REDIS_URL))
+    elif c.CACHE_BACKEND == "memory":
+        return TimedCache()
+    raise ValueError(f"Unknown cache backend: {c.CACHE_BACKEND}")
+
+
+@cache
+def get_forecast_cache_backend() -> CacheBackend:
+    # Forecasts are also persisted on disk so that they survive restarts, unless the shared backend already stores them
+    if c.CACHE_BACKEND == "memory" and c.FORECAST_CACHE_PERSISTENT:
+        return TieredCache(get_cache_backend(), SQLiteCacheBackend(c.FORECAST_CACHE_DB_PATH))
+    return get_cache_backend()
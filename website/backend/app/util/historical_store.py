@@ -0,0 +1,243 @@
+import os
+import json
+import fcntl
+import numpy as np
+import pandas as pd
+from typing import NamedTuple, Optional
+
+from rolling_aggregates import extend_prefix_sums, prefix_sums, window_mean, window_sum
+
+ONE_DAY = np.timedelta64(1, "D")
+
+HISTORICAL_COLUMNS = ["evaporation_sum", "rainfall_sum", "soil_moisture_avg", "temp_avg", "temp_max", "temp_min"]
+RELOAD_ATTEMPTS = 3
+
+
+class StoreState(NamedTuple):
+    start_date: Optional[np.datetime64]
+    num_days: int
+    columns: dict[str, np.ndarray]
+    prefix_sums: dict[str, np.ndarray]
+    generation: int  # Suffix of the files, changed when they are rewritten instead of extended
+    writes: int  # Number of writes, changed by every write even when it only replaces stored days
+
+
+class HistoricalWeatherStore:
+    """
+    Daily historical weather of a location, stored as one contiguous float32 file per variable and memory-mapped.
+
+    Index i of every array is the day start_date + i, missing days are NaN. Taking a range of days is an O(1) slice
+    that does not copy nor read the rest of the history. The prefix sums of every column are stored next to it and
+    updated with the new days, so the sum or mean of any range is O(1) as well.
+
+    The mapped files are replaced by a single assignment of the state, readers take it once so that they never mix
+    the arrays and dates of two versions.
+    """
+
+    META_FILE = "meta.json"
+    LOCK_FILE = ".lock"  # Serializes the writes of the workers sharing the store
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        columns = {column: np.empty(0, dtype=np.float32) for column in HISTORICAL_COLUMNS}
+        prefix = {column: prefix_sums(values) for column, values in columns.items()}
+        self._state = StoreState(None, 0, columns, prefix, 0, 0)
+
+        os.makedirs(directory, exist_ok=True)
+        self.reload()
+
+    @property
+    def start_date(self) -> Optional[np.datetime64]:
+        return self._state.start_date
+
+    @property
+    def num_days(self) -> int:
+        return self._state.num_days
+
+    @property
+    def columns(self) -> dict[str, np.ndarray]:
+        return self._state.columns
+
+    @property
+    def prefix_sums(self) -> dict[str, np.ndarray]:
+        return self._state.prefix_sums
+
+    @property
+    def version(self) -> tuple[Optional[np.datetime64], int, int]:
+        # Changes whenever the stored data changes, to be read before the data derived from it
+        state = self._state
+        return state.start_date, state.num_days, state.writes
+
+    @property
+    def end_date(self) -> Optional[np.datetime64]:
+        # Last stored day
+        state = self._state
+        return state.start_date + (state.num_days - 1) if state.num_days else None
+
+    def _column_path(self, column: str, generation: int) -> str:
+        # Generation 0 keeps the names of the stores written before the generations
+        suffix = f".{generation}" if generation else ""
+        return os.path.join(self.directory, f"{column}{suffix}.f32")
+
+    def _prefix_sums_path(self, column: str, generation: int) -> str:
+        suffix = f".{generation}" if generation else ""
+        return os.path.join(self.directory, f"{column}{suffix}.prefix.f64")
+
+    def reload(self) -> None:
+        # Map the days written in the meantime, possibly by other processes
+        meta_path = os.path.join(self.directory, self.META_FILE)
+        for attempt in range(RELOAD_ATTEMPTS):
+            if not os.path.exists(meta_path):
+                return
+
+            with open(meta_path) as meta_file:
+                meta = json.load(meta_file)
+
+            # The metadata is the source of truth, data written to the files after it by an interrupted write is
+            # ignored, as well as the files of a generation it does not point to yet
+            num_days = meta["num_days"]
+            generation = meta.get("generation", 0)
+            try:
+                columns = {
+                    column: np.memmap(
+                        self._column_path(column, generation), dtype=np.float32, mode="r", shape=(num_days,)
+                    )
+                    for column in HISTORICAL_COLUMNS
+                }
+                break
+            except FileNotFoundError:
+                # Files of the previous generation removed by a writer since the metadata was read
+                if attempt == RELOAD_ATTEMPTS - 1:
+                    raise
+
+        prefix = {column: self._load_prefix_sums(column, columns[column], generation) for column in HISTORICAL_COLUMNS}
+        start_date = np.datetime64(meta["start_date"], "D")
+        self._state = StoreState(start_date, num_days, columns, prefix, generation, meta.get("writes", 0))
+
+    def _load_prefix_sums(self, column: str, column_data: np.ndarray, generation: int) -> np.ndarray:
+        path = self._prefix_sums_path(column, generation)
+        num_days = len(column_data)
+        if os.path.exists(path) and os.path.getsize(path) >= (num_days + 1) * 16:
+            return np.memmap(path, dtype=np.float64, mode="r", shape=(num_days + 1, 2))
+
+        # Stores written by older versions have no prefix sums, they are computed until the next write
+        return prefix_sums(column_data)
+
+    def _write_meta(self, start_date: np.datetime64, num_days: int, generation: int, writes: int) -> None:
+        # Replace the metadata atomically, so readers never see a partially written file
+        meta_path = os.path.join(self.directory, self.META_FILE)
+        with open(meta_path + ".tmp", "w") as meta_file:
+            meta = {"start_date": str(start_date), "num_days": num_days, "generation": generation, "writes": writes}
+            json.dump(meta, meta_file)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def write(self, weather_df: pd.DataFrame) -> None:
+        """
+        Insert or replace the days of weather_df (a "date" column and the HISTORICAL_COLUMNS), extending the files.
+        """
+        if weather_df.empty:
+            return
+
+        with open(os.path.join(self.directory, self.LOCK_FILE), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.reload()
+            self._write(weather_df)
+
+    def _write(self, weather_df: pd.DataFrame) -> None:
+        state = self._state
+        days = pd.to_datetime(weather_df["date"], format="mixed").to_numpy().astype("datetime64[D]")
+        first_day, last_day = days.min(), days.max()
+        if state.num_days:
+            first_day, last_day = min(first_day, state.start_date), max(last_day, self.end_date)
+        num_days = int((last_day - first_day) // ONE_DAY) + 1
+        offsets = (days - first_day) // ONE_DAY
+        shifted = bool(state.num_days) and first_day < state.start_date
+        first_changed = 0 if shifted else min(int(offsets.min()), state.num_days)  # Prefix sums are valid until there
+
+        # Shifted files are written as a new generation, the current one stays valid until the metadata points to the
+        # new one
+        generation = state.generation + 1 if shifted else state.generation
+        for column in HISTORICAL_COLUMNS:
+            path = self._column_path(column, generation)
+            values = weather_df[column].to_numpy(dtype=np.float32)
+
+            if shifted:
+                # Days before the stored ones, the whole file has to be shifted (only for unusual backfills)
+                shift = int((state.start_date - first_day) // ONE_DAY)
+                data = np.full(num_days, np.nan, dtype=np.float32)
+                data[shift:][: state.num_days] = state.columns[column]
+                data[offsets] = values
+                data.tofile(path)
+                self._write_prefix_sums(column, data, 0, generation)
+                continue
+
+            # Extend the file with missing days, then write the new values in place
+            with open(path, "r+b" if state.num_days else "wb") as column_file:
+                column_file.seek(state.num_days * 4)
+                column_file.write(np.full(num_days - state.num_days, np.nan, dtype=np.float32).tobytes())
+
+            column_data = np.memmap(path, dtype=np.float32, mode="r+", shape=(num_days,))
+            column_data[offsets] = values
+            column_data.flush()
+            self._write_prefix_sums(column, column_data, first_changed, generation)
+            del column_data
+
+        self._write_meta(first_day, num_days, generation, state.writes + 1)
+        self.reload()
+
+        if generation != state.generation:
+            # Not read anymore once the metadata is replaced, the processes that mapped them keep their mappings
+            for column in HISTORICAL_COLUMNS:
+                for path in (
+                    self._column_path(column, state.generation),
+                    self._prefix_sums_path(column, state.generation),
+                ):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def _write_prefix_sums(self, column: str, column_data: np.ndarray, first_changed: int, generation: int) -> None:
+        # Only the prefix sums after the first changed day are computed and written (just the new days when appending)
+        path = self._prefix_sums_path(column, generation)
+        if first_changed == 0 or not os.path.exists(path) or os.path.getsize(path) < (first_changed + 1) * 16:
+            prefix_sums(column_data).tofile(path + ".tmp")
+            os.replace(path + ".tmp", path)
+            return
+
+        last_prefix = np.fromfile(path, dtype=np.float64, count=2, offset=first_changed * 16)
+        with open(path, "r+b") as prefix_file:
+            prefix_file.seek((first_changed + 1) * 16)
+            prefix_file.write(extend_prefix_sums(last_prefix, column_data[first_changed:]).tobytes())
+            prefix_file.truncate()
+
+    @staticmethod
+    def _window_bounds(state: StoreState, first_date: np.datetime64, last_date: np.datetime64) -> tuple[int, int]:
+        # Indices of the stored days between first_date and last_date (both included)
+        if not state.num_days:
+            return 0, 0
+        start = max(0, min(state.num_days, int((np.datetime64(first_date, "D") - state.start_date) // ONE_DAY)))
+        stop = max(start, min(state.num_days, int((np.datetime64(last_date, "D") - state.start_date) // ONE_DAY) + 1))
+        return start, stop
+
+    def window(self, first_date: np.datetime64, last_date: np.datetime64) -> dict[str, np.ndarray]:
+        """
+        Views of every column between first_date and last_date (both included), limited to the stored days.
+        """
+        state = self._state
+        start, stop = self._window_bounds(state, first_date, last_date)
+        return {column: values[start:stop] for column, values in state.columns.items()}
+
+    def window_sums(self, first_date: np.datetime64, last_date: np.datetime64) -> dict[str, float]:
+        """
+        Sum of every column between first_date and last_date (both included), missing days are skipped.
+        """
+        state = self._state
+        start, stop = self._window_bounds(state, first_date, last_date)
+        return {column: float(window_sum(prefix, start, stop)) for column, prefix in state.prefix_sums.items()}
+
+    def window_means(self, first_date: np.datetime64, last_date: np.datetime64) -> dict[str, float]:
+        """
+        Mean of every column between first_date and last_date (both included), NaN if all the days are missing.
+        """
+        state = self._state
+        start, stop = self._window_bounds(state, first_date, last_date)
+        return {column: float(window_mean(prefix, start, stop)) for column, prefix in state.prefix_sums.items()}
@@ -1,23 +1,43 @@
-import torch
+import os
+import math
+import fcntl
+import time
 import requests
+import threading
+import numpy as np
 import pandas as pd
 import sqlite3
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import crops
 import config as c
-from neural_networks.neural_network_temp_stress import NN_temp_stress
-from neural_networks.neural_network_drought_stress import NN_drought_stress
-from util.util import SingletonMeta
+from neural_networks.numpy_mlp import NumpyMLP, NumpyFusedMLP, limit_blas_threads, load_state_dict
+from neural_networks.onnx_model import OnnxModel
+from neural_networks.feature_buffer import TemperatureFeatureBuffer
+from util.util import SingletonMeta, location_key
+from util.historical_store import HistoricalWeatherStore, HISTORICAL_COLUMNS
 
+HISTORICAL_DB_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"  # Format of the dates stored in the databases
 
-def fetch_historical_weather_data(start_date: str, end_date: str):
+
+def get_historical_weather_db_path(latitude: float, longitude: float) -> str:
+    if location_key(latitude, longitude) == location_key(c.SORRISO_LATITUDE, c.SORRISO_LONGITUDE):
+        return c.HISTORICAL_WEATHER_DB_PATH
+    return c.HISTORICAL_WEATHER_DB_PATH_TEMPLATE.format(*location_key(latitude, longitude))
+
+
+def get_historical_weather_store_dir(latitude: float, longitude: float) -> str:
+    return c.HISTORICAL_STORE_DIR_TEMPLATE.format(*location_key(latitude, longitude))
+
+
+def fetch_historical_weather_data(latitude: float, longitude: float, start_date: str, end_date: str):
     payload = {
         "units": {"temperature": "C", "velocity": "km/h", "length": "metric", "energy": "watts"},
         "geometry": {
             "type": "MultiPoint",
-            "coordinates": [[c.SORRISO_LONGITUDE, c.SORRISO_LATITUDE]],
-            "locationNames": [c.SORRISO_NAME],
+            "coordinates": [[longitude, latitude]],
+            "locationNames": [f"{latitude},{longitude}"],
             "mode": "preferLandWithMatchingElevation",
         },
         "format": "json",
@@ -65,7 +85,9 @@ def fetch_historical_weather_data(start_date: str, end_date: str):
 
     headers = {"content-type": "application/json"}
     querystring = {"apikey": c.HISTORICAL_API_KEY}
-    response = requests.post(c.HISTORICAL_API_URL, json=payload, headers=headers, params=querystring)
+    response = requests.post(
+        c.HISTORICAL_API_URL, json=payload, headers=headers, params=querystring, timeout=c.HISTORICAL_TIMEOUT_SECONDS
+    )
 
     if response.status_code != 200:
         raise Exception(f"API request failed with status code {response.status_code}: {response.text}")
@@ -112,27 +134,139 @@ def fetch_historical_weather_data(start_date: str, end_date: str):
     return new_weather_data_df
 
 
+def open_historical_weather_db(db_path: str) -> sqlite3.Connection:
+    weather_db = sqlite3.connect(db_path, timeout=30)
+    weather_db.execute("PRAGMA journal_mode=WAL")  # Readers are not blocked during the updates
+
+    weather_db.execute(
+        f"CREATE TABLE IF NOT EXISTS historical_weather_data "
+        f"(date TIMESTAMP PRIMARY KEY, {', '.join(f'{column} REAL' for column in HISTORICAL_COLUMNS)})"
+    )
+
+    # Databases created by older versions have no key on the date, migrate them once
+    date_index = weather_db.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='historical_weather_data' AND sql IS NULL "
+        "UNION SELECT name FROM sqlite_master WHERE name='historical_weather_data_date'"
+    ).fetchone()
+    if date_index is None:
+        with weather_db:
+            # Same format for all the dates, so that they can be compared as strings
+            weather_db.execute("UPDATE historical_weather_data SET date = datetime(date)")
+            # Keep the most recently inserted row of each day
+            weather_db.execute(
+                "DELETE FROM historical_weather_data WHERE rowid NOT IN "
+                "(SELECT MAX(rowid) FROM historical_weather_data GROUP BY date)"
+            )
+            weather_db.execute("CREATE UNIQUE INDEX historical_weather_data_date ON historical_weather_data (date)")
+
+    return weather_db
+
+
+# Model formats run with PyTorch, the others take and return NumPy arrays and do not import it
+TORCH_MODEL_FORMATS = ("eager", "torchscript")
+
+
+def get_exported_model_path(name: str, model_format: str) -> str:
+    return c.EXPORTED_MODEL_PATH_TEMPLATE.format(name, "onnx" if model_format == "onnx" else "pt")
+
+
+def load_exported_model(name: str, model_format: str):
+    # Models produced by export_models.py, they run on CPU
+    path = get_exported_model_path(name, model_format)
+    if model_format == "torchscript":
+        from neural_networks.torch_models import load_torchscript_model
+
+        return load_torchscript_model(path)
+    elif model_format == "onnx":
+        return OnnxModel(path)
+    raise ValueError(f"Unknown model format: {model_format}")
+
+
 class GlobalResources(metaclass=SingletonMeta):
     def __init__(self):
-        self.historical_weather_df = None
+        # Historical weather is loaded lazily for each location
+        self.historical_weather_stores: dict[tuple[float, float], HistoricalWeatherStore] = {}
+        self._historical_weather_locks: dict[tuple[float, float], threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self._last_refresh_attempts: dict[tuple[float, float], float] = {}  # Monotonic time of the last fetch
+        self.temperature_feature_buffers: dict[tuple[float, float], TemperatureFeatureBuffer] = {}
+
+        # Models are loaded in the background by start_loading, or on first use
+        self.device = None
+        if c.MODEL_FORMAT in TORCH_MODEL_FORMATS:
+            from neural_networks.torch_models import setup_torch
+
+            self.device = setup_torch(c.MODEL_FORMAT)
+        elif c.MODEL_FORMAT == "numpy":
+            limit_blas_threads(c.INFERENCE_NUM_THREADS)
         self.temp_stress_models = {}
+        self.fused_temp_stress_model = None  # All the crops in a single model, built from the others on first use
         self.drought_stress_model = None
-        self._update_database()
-        self._load_resources()
 
-    def _update_database(self):
-        try:
-            weather_db = sqlite3.connect(c.HISTORICAL_WEATHER_DB_PATH)
-            historical_weather_df = pd.read_sql("SELECT * FROM historical_weather_data", weather_db)
-            historical_weather_df["date"] = pd.to_datetime(historical_weather_df["date"], format="mixed")
+        self._loader = ThreadPoolExecutor(max_workers=c.RESOURCE_LOADER_THREADS, thread_name_prefix="resource-loader")
+        self._loading: dict[str, Future] = {}  # Loading of each resource, by name
+        self._loading_lock = threading.Lock()
 
-            # Find the latest date in the database
-            latest_date = historical_weather_df["date"].max().strftime(c.METEOBLUE_DATE_FORMAT)
+    def start_loading(self):
+        # Load the models and the default location in parallel without blocking, requests wait only for what they use
+        for crop in crops.CROPS:
+            self._load(f"temp_stress_model.{crop}", self._load_temp_stress_model, crop)
+        self._load("drought_stress_model", self._load_drought_stress_model)
+
+        # With a fast start, the missing days are fetched later by the scheduler
+        self._load(
+            f"historical_weather.{c.SORRISO_NAME}",
+            self.get_historical_weather_store,
+            c.SORRISO_LATITUDE,
+            c.SORRISO_LONGITUDE,
+            not c.FAST_START,
+        )
+
+    def _load(self, name: str, load_function, *args) -> Future:
+        # Start loading a resource unless it is already loaded or loading
+        with self._loading_lock:
+            if name not in self._loading:
+                self._loading[name] = self._loader.submit(load_function, *args)
+            return self._loading[name]
+
+    def get_loading_status(self) -> dict[str, str]:
+        with self._loading_lock:
+            loading = dict(self._loading)
+
+        status = {}
+        for name, future in sorted(loading.items()):
+            if not future.done():
+                status[name] = "loading"
+            elif future.exception() is not None:
+                status[name] = f"failed: {future.exception()}"
+            else:
+                status[name] = "loaded"
+        return status
+
+    def is_ready(self) -> bool:
+        status = self.get_loading_status()
+        return bool(status) and all(state == "loaded" for state in status.values())
+
+    def _update_database(self, latitude: float, longitude: float):
+        db_path = get_historical_weather_db_path(latitude, longitude)
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
 
-            # Calculate the date range (ends included) for the API request (fill with data until yesterday)
-            start_date = (datetime.strptime(latest_date, c.METEOBLUE_DATE_FORMAT) + timedelta(days=1)).strftime(
-                c.METEOBLUE_DATE_FORMAT
-            )
+        try:
+            weather_db = open_historical_weather_db(db_path)
+
+            # Find the latest date in the database (through the unique index)
+            latest_date = weather_db.execute("SELECT MAX(date) FROM historical_weather_data").fetchone()[0]
+
+            if latest_date is not None:
+                # Calculate the date range (ends included) for the API request (fill with data until yesterday)
+                start_date = (
+                    datetime.strptime(latest_date[:10], c.METEOBLUE_DATE_FORMAT) + timedelta(days=1)
+                ).strftime(c.METEOBLUE_DATE_FORMAT)
+            else:
+                # New location, fetch just enough history for the predictions
+                start_date = (datetime.now() - timedelta(days=c.HISTORICAL_BACKFILL_DAYS)).strftime(
+                    c.METEOBLUE_DATE_FORMAT
+                )
             end_date = (datetime.now() - timedelta(days=1)).strftime(c.METEOBLUE_DATE_FORMAT)
 
             # Database is already up-to-date
@@ -142,53 +276,175 @@ class GlobalResources(metaclass=SingletonMeta):
                 weather_db.close()
                 return
 
-            new_weather_data_df = fetch_historical_weather_data(start_date, end_date)
-            new_weather_data_df.to_sql("historical_weather_data", weather_db, if_exists="append", index=False)
-
-            database_to_df = pd.read_sql("SELECT * FROM historical_weather_data", weather_db)
-            database_to_df["date"] = pd.to_datetime(database_to_df["date"])  # Ensure consistent date format
-
-            # Remove duplicates and write back
-            database_to_df.sort_values("date").drop_duplicates(subset=["date"]).to_sql(
-                "historical_weather_data", weather_db, if_exists="replace", index=False
+            new_weather_data_df = fetch_historical_weather_data(latitude, longitude, start_date, end_date)
+            new_rows = zip(
+                new_weather_data_df["date"].dt.strftime(HISTORICAL_DB_DATE_FORMAT),
+                *(new_weather_data_df[column].tolist() for column in HISTORICAL_COLUMNS),
             )
 
+            # Upsert only the new days in a single transaction, readers see either all of them or none
+            with weather_db:
+                weather_db.executemany(
+                    f"INSERT OR REPLACE INTO historical_weather_data (date, {', '.join(HISTORICAL_COLUMNS)}) "
+                    f"VALUES ({', '.join(['?'] * (len(HISTORICAL_COLUMNS) + 1))})",
+                    new_rows,
+                )
+
             weather_db.close()
 
         except Exception as e:
-            print(f"Error updating weather database: {str(e)}")
+            print(f"Error updating weather database for ({latitude}, {longitude}): {str(e)}")
             # Make sure to close the database connection in case of error
             if "weather_db" in locals():
                 weather_db.close()
 
-    def _load_resources(self):
-        weather_db = sqlite3.connect(c.HISTORICAL_WEATHER_DB_PATH)
+    def _sync_historical_weather_store(self, latitude: float, longitude: float, store: HistoricalWeatherStore):
+        # Copy to the store only the days of the database that are more recent than the stored ones
+        store.reload()
+        weather_db = open_historical_weather_db(get_historical_weather_db_path(latitude, longitude))
 
-        self.historical_weather_df = pd.read_sql("SELECT * FROM historical_weather_data", weather_db)
-        self.historical_weather_df["date"] = pd.to_datetime(self.historical_weather_df["date"], format="ISO8601")
+        first_new_date = str(store.end_date + 1) if store.end_date is not None else ""
+        new_weather_data_df = pd.read_sql(
+            f"SELECT date, {', '.join(HISTORICAL_COLUMNS)} FROM historical_weather_data WHERE date >= ?",
+            weather_db,
+            params=(first_new_date,),
+        )
+        store.write(new_weather_data_df)
 
         weather_db.close()
 
-        # Load the PyTorch models
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        for crop in crops.CROPS:
-            model = NN_temp_stress(c.TEMP_STRESS_INPUT_SIZE, c.TEMP_STRESS_OUTPUT_SIZE, device).to(device)
-            model_state_dict = torch.load(c.TEMP_STRESS_MODEL_PATH_TEMPLATE.format(crop), map_location=device)
-            model.load_state_dict(model_state_dict)
-            model.eval()
-            self.temp_stress_models[crop] = model
-
-        d_model = NN_drought_stress(c.DROUGHT_STRESS_INPUT_SIZE, c.DROUGHT_STRESS_OUTPUT_SIZE, device).to(device)
-        d_model_state_dict = torch.load(c.DROUGHT_STRESS_MODEL_PATH_TEMPLATE, map_location=device)
-        d_model.load_state_dict(d_model_state_dict)
-        d_model.eval()
-        self.drought_stress_model = d_model
-
-    def get_historical_weather_df(self):
-        return self.historical_weather_df
+    def _load_temp_stress_model(self, crop: str):
+        if c.MODEL_FORMAT == "numpy":
+            self.temp_stress_models[crop] = NumpyMLP(load_state_dict(c.TEMP_STRESS_MODEL_PATH_TEMPLATE.format(crop)))
+        elif c.MODEL_FORMAT == "eager":
+            from neural_networks.torch_models import load_temp_stress_model
+
+            self.temp_stress_models[crop] = load_temp_stress_model(crop, self.device)
+        else:
+            self.temp_stress_models[crop] = load_exported_model(f"temp_stress_model_{crop}", c.MODEL_FORMAT)
+
+    def _load_drought_stress_model(self):
+        if c.MODEL_FORMAT == "numpy":
+            self.drought_stress_model = NumpyMLP(load_state_dict(c.DROUGHT_STRESS_MODEL_PATH_TEMPLATE))
+        elif c.MODEL_FORMAT == "eager":
+            from neural_networks.torch_models import load_drought_stress_model
+
+            self.drought_stress_model = load_drought_stress_model(self.device)
+        else:
+            self.drought_stress_model = load_exported_model("drought_stress_model", c.MODEL_FORMAT)
+
+    def _get_location_lock(self, key: tuple[float, float]) -> threading.Lock:
+        with self._locks_lock:
+            return self._historical_weather_locks.setdefault(key, threading.Lock())
+
+    def _is_outdated(self, key: tuple[float, float], store: HistoricalWeatherStore) -> bool:
+        # Yesterday is missing and was not fetched too recently (the API may not provide it yet)
+        yesterday = np.datetime64(datetime.now().date(), "D") - 1
+        if store.end_date is not None and store.end_date >= yesterday:
+            return False
+        last_attempt = self._last_refresh_attempts.get(key, -math.inf)
+        return time.monotonic() - last_attempt >= c.HISTORICAL_REFRESH_RETRY_SECONDS
+
+    def _refresh_location(self, key: tuple[float, float], store: HistoricalWeatherStore):
+        # Fetch the new days of a location and append them to its store, with the lock of the location held
+        self._last_refresh_attempts[key] = time.monotonic()
+        self._update_database(*key)
+        self._sync_historical_weather_store(*key, store)
+
+    def get_loaded_historical_weather_store(self, latitude: float, longitude: float) -> HistoricalWeatherStore | None:
+        # Store of a location if it can be used without fetching anything, None otherwise
+        key = location_key(latitude, longitude)
+        store = self.historical_weather_stores.get(key)
+        if store is None or self._is_outdated(key, store):
+            return None
+        return store
+
+    def get_historical_weather_store(
+        self, latitude: float, longitude: float, update: bool = True
+    ) -> HistoricalWeatherStore:
+        key = location_key(latitude, longitude)
+        store = self.historical_weather_stores.get(key)
+        if store is not None and not (update and self._is_outdated(key, store)):
+            return store
+
+        # Only the requests of the location wait for the backfill or the missing days, other locations are not blocked
+        with self._get_location_lock(key):
+            store = self.historical_weather_stores.get(key)
+            if store is not None:
+                # Requested before the daily refresh added yesterday, or after it failed
+                if update and self._is_outdated(key, store):
+                    self._refresh_location(key, store)
+                return store
+
+            if update:
+                self._last_refresh_attempts[key] = time.monotonic()
+                self._update_database(latitude, longitude)
+            store = HistoricalWeatherStore(get_historical_weather_store_dir(latitude, longitude))
+            self._sync_historical_weather_store(latitude, longitude, store)
+
+            # Not kept when the backfill failed, so that the next request fetches the history again
+            if store.num_days < c.NUM_DAYS_TEMP_STRESS_PREDICTION:
+                raise RuntimeError(
+                    f"Historical weather of ({latitude}, {longitude}) is not available ({store.num_days} days stored)"
+                )
+            self.historical_weather_stores[key] = store
+            return store
+
+    def get_temperature_feature_buffer(self, latitude: float, longitude: float) -> TemperatureFeatureBuffer:
+        key = location_key(latitude, longitude)
+        if key not in self.temperature_feature_buffers:
+            with self._locks_lock:
+                self.temperature_feature_buffers.setdefault(
+                    key, TemperatureFeatureBuffer(c.NUM_DAYS_TEMP_STRESS_PREDICTION, c.FORECAST_DAYS)
+                )
+        return self.temperature_feature_buffers[key]
+
+    def refresh_historical_weather(self):
+        # Fetch the new days of every loaded location and append them to its store, several locations at a time. The
+        # workers refresh one after the other: the first one fetches the new days, the next ones find them on disk and
+        # only fetch the locations that the previous ones had not loaded
+        os.makedirs(os.path.dirname(c.HISTORICAL_REFRESH_LOCK_PATH), exist_ok=True)
+        with open(c.HISTORICAL_REFRESH_LOCK_PATH, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with ThreadPoolExecutor(c.HISTORICAL_REFRESH_CONCURRENCY, thread_name_prefix="refresh") as executor:
+                for future in [
+                    executor.submit(self._refresh_loaded_location, key, store)
+                    for key, store in list(self.historical_weather_stores.items())
+                ]:
+                    future.result()
+
+    def _refresh_loaded_location(self, key: tuple[float, float], store: HistoricalWeatherStore):
+        yesterday = np.datetime64(datetime.now().date(), "D") - 1
+        with self._get_location_lock(key):
+            self._sync_historical_weather_store(*key, store)
+            if store.end_date is None or store.end_date < yesterday:
+                self._refresh_location(key, store)
 
     def get_temp_stress_model(self, crop: str):
+        # Wait for the model if it is still loading, or load it now
+        if crop not in self.temp_stress_models:
+            if crop not in crops.CROPS:
+                raise KeyError(crop)
+            self._load(f"temp_stress_model.{crop}", self._load_temp_stress_model, crop).result()
         return self.temp_stress_models[crop]
 
+    def get_fused_temp_stress_model(self):
+        # Outputs of the crops are ordered as crops.CROPS
+        if self.fused_temp_stress_model is None:
+            if c.MODEL_FORMAT == "numpy":
+                fused_model = NumpyFusedMLP([self.get_temp_stress_model(crop) for crop in crops.CROPS])
+            elif c.MODEL_FORMAT == "eager":
+                from neural_networks.neural_network_temp_stress import NN_temp_stress_fused
+
+                fused_model = NN_temp_stress_fused([self.get_temp_stress_model(crop) for crop in crops.CROPS]).eval()
+            else:
+                fused_model = load_exported_model("temp_stress_model_fused", c.MODEL_FORMAT)
+            with self._loading_lock:
+                if self.fused_temp_stress_model is None:
+                    self.fused_temp_stress_model = fused_model
+        return self.fused_temp_stress_model
+
     def get_drought_stress_model(self):
+        if self.drought_stress_model is None:
+            self._load("drought_stress_model", self._load_drought_stress_model).result()
         return self.drought_stress_model
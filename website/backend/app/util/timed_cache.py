@@ -1,11 +1,19 @@
+import sys
 import time
+import heapq
+import asyncio
 import hashlib
 import inspect
+import weakref
+import threading
+import numpy as np
 import pandas as pd
 from enum import Enum
-from typing import Any, Callable, Optional, TypeVar
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, NamedTuple, Optional, TypeVar
 from functools import wraps
 
+import config as c
 from util.util import SingletonMeta
 
 
@@ -16,44 +24,270 @@ class CacheCategory(Enum):
     DB_DATA = "database_data"
 
 
-class TimedCache(metaclass=SingletonMeta):
-    def __init__(self):
-        # Associate an automatically generated key with the cached data, the time creation and the TTL
-        self.cache: dict[str, tuple[Any, float, int]] = {}
+class CacheEntry(NamedTuple):
+    value: Any
+    timestamp: float  # Creation time
+    ttl: int
+    stale_seconds: int  # Additional time during which the expired value can be served while it is refreshed
+    category: Optional[CacheCategory]
+    size: int  # Approximate size in bytes
+
+    @property
+    def deadline(self) -> float:
+        return self.timestamp + self.ttl + self.stale_seconds
+
+
+def estimate_size(value: Any) -> int:
+    # Approximate memory used by a cached value, following containers recursively
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    elif isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    elif isinstance(value, np.ndarray):
+        return sys.getsizeof(value) if value.base is None else value.nbytes
+    elif isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class CacheBackend:
+    """
+    Storage used by the cached decorator.
+
+    Backends shared between processes also implement try_lock and unlock, so that only one worker computes a key.
+    Their methods do network or disk I/O, the decorator calls them outside of the event loop.
+    """
+
+    is_local = False  # Entries kept in the memory of the process, read and written without I/O
+
+    def get_record(self, key: str) -> Optional[CacheEntry]:
+        # Return the entry if it can still be served (fresh or stale), None otherwise
+        raise NotImplementedError
+
+    def get_entry(self, key: str) -> Optional[tuple[Any, bool]]:
+        # Return the cached value and whether it is still fresh, or None if it cannot be served anymore
+        entry = self.get_record(key)
+        if entry is None:
+            return None
+        return entry.value, time.time() - entry.timestamp < entry.ttl
 
     def get(self, key: str) -> Optional[Any]:
-        if key in self.cache:
-            cached_value, timestamp, ttl = self.cache[key]
+        entry = self.get_entry(key)
+        if entry is not None and entry[1]:
+            return entry[0]
+        return None
 
-            # Cache entry still valid
-            if time.time() - timestamp < ttl:
-                return cached_value
-            else:
+    def get_local_entry(self, key: str) -> Optional[tuple[Any, bool]]:
+        # Like get_entry, but only looking in the memory of the process, None if the entry has to be read with I/O
+        return self.get_entry(key) if self.is_local else None
+
+    def set(
+        self,
+        key: str,
+        cached_value: Any,
+        ttl_seconds: int,
+        stale_seconds: int = 0,
+        category: Optional[CacheCategory] = None,
+        timestamp: Optional[float] = None,
+    ) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def cleanup_expired(self) -> int:
+        raise NotImplementedError
+
+    def invalidate_category(self, category: CacheCategory) -> int:
+        # Remove all the entries of the category, returning how many were removed
+        raise NotImplementedError
+
+    def try_lock(self, key: str, lease_seconds: float) -> bool:
+        # Nothing to do for a cache private to the process, concurrent calls are already coalesced in the decorator
+        return True
+
+    def unlock(self, key: str) -> None:
+        pass
+
+
+class TimedCache(CacheBackend, metaclass=SingletonMeta):
+    is_local = True
+
+    def __init__(
+        self,
+        max_entries: int = c.CACHE_MAX_ENTRIES,
+        max_bytes: int = c.CACHE_MAX_BYTES,
+        category_max_entries: Optional[dict[str, int]] = None,
+        category_max_bytes: Optional[dict[str, int]] = None,
+    ):
+        # Associate an automatically generated key with the cached entry, least recently used first
+        self.cache: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.total_bytes = 0
+
+        # Limits for the whole cache and for each category (identified by its value), evicting the least recently used
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.category_max_entries = category_max_entries or c.CACHE_CATEGORY_MAX_ENTRIES
+        self.category_max_bytes = category_max_bytes or c.CACHE_CATEGORY_MAX_BYTES
+        self._category_keys: dict[Optional[CacheCategory], OrderedDict[str, None]] = defaultdict(OrderedDict)
+        self._category_bytes: dict[Optional[CacheCategory], int] = defaultdict(int)
+
+        # Min-heap of (deadline, key), entries replaced or evicted in the meantime are skipped when popped
+        self._expiry_heap: list[tuple[float, str]] = []
+
+        # Entries are set from the event loop, the threads running sync functions and the background refreshes
+        self._lock = threading.RLock()
+
+    def get_record(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                return None
+
+            if time.time() >= entry.deadline:
                 # Remove expired entry
-                del self.cache[key]
-        return None
+                self._remove(key)
+                return None
+
+            # Mark as recently used
+            self.cache.move_to_end(key)
+            self._category_keys[entry.category].move_to_end(key)
 
-    def set(self, key: str, cached_value: Any, ttl_seconds: int) -> None:
-        self.cleanup_expired()
-        self.cache[key] = (cached_value, time.time(), ttl_seconds)
+            # Cache entry still valid
+            return entry
+
+    def set(
+        self,
+        key: str,
+        cached_value: Any,
+        ttl_seconds: int,
+        stale_seconds: int = 0,
+        category: Optional[CacheCategory] = None,
+        timestamp: Optional[float] = None,
+    ) -> None:
+        size = estimate_size(cached_value)
+        category_name = category.value if category else None
+
+        with self._lock:
+            self.cleanup_expired()
+            self._remove(key)
+
+            # Values that would not fit even in an empty cache are not stored
+            if size > self.max_bytes or size > self.category_max_bytes.get(category_name, self.max_bytes):
+                return
+
+            timestamp = time.time() if timestamp is None else timestamp
+            entry = CacheEntry(cached_value, timestamp, ttl_seconds, stale_seconds, category, size)
+            self.cache[key] = entry
+            self._category_keys[category][key] = None
+            self._category_bytes[category] += size
+            self.total_bytes += size
+            heapq.heappush(self._expiry_heap, (entry.deadline, key))
+
+            self._evict(category)
 
     def delete(self, key: str) -> bool:
-        if key in self.cache:
-            del self.cache[key]
-            return True
-        return False
+        with self._lock:
+            return self._remove(key)
 
     def clear(self) -> None:
-        self.cache.clear()
+        with self._lock:
+            self.cache.clear()
+            self._category_keys.clear()
+            self._category_bytes.clear()
+            self._expiry_heap.clear()
+            self.total_bytes = 0
 
     def cleanup_expired(self) -> int:
         current_time = time.time()
-        expired_keys = [key for key, (_, timestamp, ttl) in self.cache.items() if current_time - timestamp >= ttl]
+        removed = 0
+
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= current_time:
+                deadline, key = heapq.heappop(self._expiry_heap)
+                entry = self.cache.get(key)
+
+                # Skip keys that have been replaced or removed since they were pushed
+                if entry is not None and entry.deadline == deadline:
+                    self._remove(key)
+                    removed += 1
+
+            # Drop the skipped keys if they pile up
+            if len(self._expiry_heap) > 2 * len(self.cache) + 64:
+                self._expiry_heap = [(entry.deadline, key) for key, entry in self.cache.items()]
+                heapq.heapify(self._expiry_heap)
+
+        return removed
+
+    def invalidate_category(self, category: CacheCategory) -> int:
+        with self._lock:
+            keys = list(self._category_keys.get(category, ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def _remove(self, key: str) -> bool:
+        entry = self.cache.pop(key, None)
+        if entry is None:
+            return False
 
-        for key in expired_keys:
-            del self.cache[key]
+        del self._category_keys[entry.category][key]
+        self._category_bytes[entry.category] -= entry.size
+        self.total_bytes -= entry.size
+        return True
 
-        return len(expired_keys)
+    def _evict(self, category: Optional[CacheCategory]) -> None:
+        # Evict the least recently used entries of the category over its quota, then of the whole cache
+        category_name = category.value if category else None
+        max_entries = self.category_max_entries.get(category_name, self.max_entries)
+        max_bytes = self.category_max_bytes.get(category_name, self.max_bytes)
+
+        category_keys = self._category_keys[category]
+        while category_keys and (len(category_keys) > max_entries or self._category_bytes[category] > max_bytes):
+            self._remove(next(iter(category_keys)))
+
+        while self.cache and (len(self.cache) > self.max_entries or self.total_bytes > self.max_bytes):
+            self._remove(next(iter(self.cache)))
+
+
+# Fingerprints attached to DataFrames, by object identity. The values returned by cached functions get their cache
+# key and computation time as fingerprint, so passing them on to other cached functions does not hash their content
+# again, while a refreshed value under the same key still gets a different fingerprint.
+# Cached values are shared between callers and must be treated as read-only.
+_fingerprints: dict[int, tuple[weakref.ref, str]] = {}
+
+
+def set_fingerprint(data: Any, fingerprint: str) -> None:
+    key = id(data)
+
+    # Forget the fingerprint as soon as the object is garbage collected, before its id can be reused
+    def forget(ref: weakref.ref) -> None:
+        if _fingerprints.get(key, (None,))[0] is ref:
+            _fingerprints.pop(key, None)
+
+    try:
+        _fingerprints[key] = (weakref.ref(data, forget), fingerprint)
+    except TypeError:
+        pass  # Not weak-referenceable
+
+
+def get_fingerprint(data: Any) -> Optional[str]:
+    item = _fingerprints.get(id(data))
+    if item is not None and item[0]() is data:
+        return item[1]
+    return None
+
+
+def hash_dataframe(data: pd.DataFrame) -> str:
+    hasher = hashlib.sha1()
+    hasher.update(str(list(data.columns)).encode())
+    hasher.update(pd.util.hash_pandas_object(data).to_numpy().tobytes())
+    return hasher.hexdigest()
 
 
 def generate_cache_key(*args: Any, **kwargs: Any) -> str:
@@ -62,8 +296,12 @@ def generate_cache_key(*args: Any, **kwargs: Any) -> str:
     # Recursively update hash with different data types
     def update_hash(data: Any) -> None:
         if isinstance(data, pd.DataFrame):
-            hasher.update(data.columns.to_numpy().tobytes())
-            hasher.update(pd.util.hash_pandas_object(data).to_numpy().tobytes())
+            # Hash the content only the first time the object is seen
+            fingerprint = get_fingerprint(data)
+            if fingerprint is None:
+                fingerprint = hash_dataframe(data)
+                set_fingerprint(data, fingerprint)
+            hasher.update(fingerprint.encode())
         elif isinstance(data, (list, tuple)):
             for item in data:
                 update_hash(item)
@@ -89,46 +327,167 @@ def generate_cache_key(*args: Any, **kwargs: Any) -> str:
 T = TypeVar("T")
 
 
-def cached(cache_instance: TimedCache, category: CacheCategory, ttl_seconds: int) -> Callable:
+async def call_backend(cache_instance: CacheBackend, method: Callable[..., T], *args: Any) -> T:
+    # Only the in-process cache is used from the event loop, the other backends are called in a thread
+    if cache_instance.is_local:
+        return method(*args)
+    return await asyncio.to_thread(method, *args)
+
+
+# Computation shared by all the threads asking for the same key at the same time
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+    def wait(self) -> Any:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def cached(cache_instance: CacheBackend, category: CacheCategory, ttl_seconds: int, stale_seconds: int = 0) -> Callable:
+    """
+    Cache the results of the decorated function for ttl_seconds.
+
+    Concurrent callers asking for the same key share a single computation, also across the workers using a shared
+    cache backend. If stale_seconds is set, an expired value is still returned for that long while a single background
+    computation refreshes it.
+    """
 
     def decorator(func: Callable[..., T]) -> Callable[..., T]:
+        func_key = f"{func.__module__}.{func.__name__}"
+        if category:
+            func_key = f"{category.value}.{func_key}"
+
+        async_in_flight: dict[str, asyncio.Task] = {}
+        sync_in_flight: dict[str, _InFlightCall] = {}
+        sync_lock = threading.Lock()
+
+        def start_async_call(cache_key: str, args: tuple, kwargs: dict, revalidate: bool = False) -> asyncio.Task:
+            async def compute() -> T:
+                try:
+                    # Refresh of a stale value, another worker may already have stored a fresh one
+                    if revalidate:
+                        cached_result = await call_backend(cache_instance, cache_instance.get, cache_key)
+                        if cached_result is not None:
+                            return cached_result
+
+                    # Wait for the result if another worker is already computing it
+                    locked = await call_backend(
+                        cache_instance, cache_instance.try_lock, cache_key, c.CACHE_LOCK_LEASE_SECONDS
+                    )
+                    if not locked:
+                        deadline = time.time() + c.CACHE_LOCK_LEASE_SECONDS
+                        while time.time() < deadline:
+                            await asyncio.sleep(c.CACHE_LOCK_POLL_SECONDS)
+                            cached_result = await call_backend(cache_instance, cache_instance.get, cache_key)
+                            if cached_result is not None:
+                                return cached_result
+
+                    result = await func(*args, **kwargs)
+                    if isinstance(result, pd.DataFrame):
+                        set_fingerprint(result, f"{cache_key}.{time.time_ns()}")
+
+                    # Store in cache
+                    await call_backend(
+                        cache_instance, cache_instance.set, cache_key, result, ttl_seconds, stale_seconds, category
+                    )
+                    return result
+                finally:
+                    try:
+                        await call_backend(cache_instance, cache_instance.unlock, cache_key)
+                    finally:
+                        async_in_flight.pop(cache_key, None)
+
+            task = asyncio.ensure_future(compute())
+            # Errors are raised to the waiting callers, a background refresh has none and just retries later
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            async_in_flight[cache_key] = task
+            return task
+
         @wraps(func)
         async def async_wrapper(*args: Any, **kwargs: Any) -> T:
-            func_key = f"{func.__module__}.{func.__name__}"
-            if category:
-                func_key = f"{category.value}.{func_key}"
             cache_key = generate_cache_key(func_key, *args, **kwargs)
 
-            # Try to retrieve from cache
-            cached_result = cache_instance.get(cache_key)
-            if cached_result is not None:
+            # Try to retrieve from cache, refreshing stale values in the background. The shared backends are only read
+            # when the value is not in memory and not already being computed
+            entry = cache_instance.get_local_entry(cache_key)
+            if entry is None and not cache_instance.is_local and cache_key not in async_in_flight:
+                entry = await asyncio.to_thread(cache_instance.get_entry, cache_key)
+            if entry is not None and entry[0] is not None:
+                cached_result, fresh = entry
+                if not fresh and cache_key not in async_in_flight:
+                    start_async_call(cache_key, args, kwargs, revalidate=True)
                 return cached_result
 
-            # Call the function if not cached
-            result = await func(*args, **kwargs)
-
-            # Store in cache
-            cache_instance.set(cache_key, result, ttl_seconds)
-            return result
+            # Call the function if not cached, or wait for the call already in progress
+            task = async_in_flight.get(cache_key) or start_async_call(cache_key, args, kwargs)
+
+            # A cancelled caller must not cancel the computation shared with the other callers
+            return await asyncio.shield(task)
+
+        def run_sync_call(
+            cache_key: str, call: _InFlightCall, args: tuple, kwargs: dict, revalidate: bool = False
+        ) -> None:
+            try:
+                # Refresh of a stale value, another worker may already have stored a fresh one
+                if revalidate:
+                    call.result = cache_instance.get(cache_key)
+                    if call.result is not None:
+                        return
+
+                # Wait for the result if another worker is already computing it
+                if not cache_instance.try_lock(cache_key, c.CACHE_LOCK_LEASE_SECONDS):
+                    deadline = time.time() + c.CACHE_LOCK_LEASE_SECONDS
+                    while time.time() < deadline:
+                        time.sleep(c.CACHE_LOCK_POLL_SECONDS)
+                        call.result = cache_instance.get(cache_key)
+                        if call.result is not None:
+                            return
+
+                call.result = func(*args, **kwargs)
+                if isinstance(call.result, pd.DataFrame):
+                    set_fingerprint(call.result, f"{cache_key}.{time.time_ns()}")
+
+                # Store in cache
+                cache_instance.set(cache_key, call.result, ttl_seconds, stale_seconds, category)
+            except BaseException as e:
+                call.error = e
+            finally:
+                cache_instance.unlock(cache_key)
+                with sync_lock:
+                    sync_in_flight.pop(cache_key, None)
+                call.done.set()
 
         @wraps(func)
         def sync_wrapper(*args: Any, **kwargs: Any) -> T:
-            func_key = f"{func.__module__}.{func.__name__}"
-            if category:
-                func_key = f"{category.value}.{func_key}"
             cache_key = generate_cache_key(func_key, *args, **kwargs)
 
-            # Try to retrieve from cache
-            cached_result = cache_instance.get(cache_key)
-            if cached_result is not None:
-                return cached_result
+            with sync_lock:
+                # Try to retrieve from cache, refreshing stale values in a background thread
+                entry = cache_instance.get_entry(cache_key)
+                if entry is not None and entry[0] is not None:
+                    cached_result, fresh = entry
+                    if not fresh and cache_key not in sync_in_flight:
+                        call = sync_in_flight[cache_key] = _InFlightCall()
+                        threading.Thread(
+                            target=run_sync_call, args=(cache_key, call, args, kwargs, True), daemon=True
+                        ).start()
+                    return cached_result
+
+                # Wait for the call already in progress, if any
+                call = sync_in_flight.get(cache_key)
+                is_owner = call is None
+                if is_owner:
+                    call = sync_in_flight[cache_key] = _InFlightCall()
 
             # Call the function if not cached
-            result = func(*args, **kwargs)
-
-            # Store in cache
-            cache_instance.set(cache_key, result, ttl_seconds)
-            return result
+            if is_owner:
+                run_sync_call(cache_key, call, args, kwargs)
+            return call.wait()
 
         # Choose the appropriate wrapper based on whether the function is async
         if inspect.iscoroutinefunction(func):
@@ -1,5 +1,7 @@
 import threading
 
+import config as c
+
 
 # Thread-safe singleton metaclass
 class SingletonMeta(type):
@@ -12,3 +14,8 @@ class SingletonMeta(type):
                 if cls not in cls._instances:
                     cls._instances[cls] = super().__call__(*args, **kwargs)
         return cls._instances[cls]
+
+
+# Round coordinates so that nearby requests share historical data, forecasts and predictions
+def location_key(latitude: float, longitude: float) -> tuple[float, float]:
+    return round(latitude, c.COORDINATE_PRECISION), round(longitude, c.COORDINATE_PRECISION)
@@ -0,0 +1,44 @@
+"""
+Micro-benchmark of the cache key derivation for DataFrame arguments.
+
+Compares hashing the whole frame on every call with reusing the fingerprint stored for the object.
+Run from website/backend: python benchmarks/cache_key_benchmark.py
+"""
+
+import os
+import sys
+import timeit
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from util.timed_cache import generate_cache_key, hash_dataframe, set_fingerprint  # noqa: E402
+
+FRAME_SIZES = [8, 738, 18_000, 180_000]  # Forecast, temperature stress input, full history, 10 locations
+COLUMNS = ["evaporation_sum", "rainfall_sum", "soil_moisture_avg", "temp_avg", "temp_max", "temp_min"]
+
+
+def make_frame(num_rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.random((num_rows, len(COLUMNS))), columns=COLUMNS)
+    df.insert(0, "date", pd.date_range("1976-01-01", periods=num_rows))
+    return df
+
+
+def time_call(func, number: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6  # Microseconds per call
+
+
+if __name__ == "__main__":
+    print(f"{'rows':>10} {'content hash (us)':>20} {'fingerprint (us)':>20} {'speedup':>10}")
+    for num_rows in FRAME_SIZES:
+        df = make_frame(num_rows)
+        number = max(10, 100_000 // num_rows)
+
+        content = time_call(lambda: generate_cache_key("func", "corn", -12.55, -55.73, hash_dataframe(df)), number)
+
+        set_fingerprint(df, "upstream-cache-key")
+        fingerprint = time_call(lambda: generate_cache_key("func", "corn", -12.55, -55.73, df), number)
+
+        print(f"{num_rows:>10} {content:>20.1f} {fingerprint:>20.1f} {content / fingerprint:>9.0f}x")
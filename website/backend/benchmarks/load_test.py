@@ -0,0 +1,101 @@
+"""
+Load test of a running backend with concurrent mixed traffic (forecasts, temperature and drought stress).
+
+Reports the throughput and the latency percentiles of each route, the event loop must keep serving the forecasts while
+the predictions run.
+Run from website/backend, with the server started: python benchmarks/load_test.py --concurrency 64 --duration 30
+"""
+
+import time
+import random
+import asyncio
+import argparse
+import httpx
+import numpy as np
+
+CROPS = ["corn", "cotton", "rice", "soybean", "wheat"]
+SORRISO = (-12.5471531, -55.7319178)
+
+# Share of each route in the traffic
+ROUTES = {
+    "forecast": 0.4,
+    "temp_stress": 0.4,
+    "drought_stress": 0.2,
+}
+
+
+def make_request(num_locations: int) -> tuple[str, str, dict]:
+    # Random route at one of the tested locations, 0.01° apart from Sorriso so that each one has its own history
+    route = random.choices(list(ROUTES), weights=list(ROUTES.values()))[0]
+    location = random.randrange(num_locations)
+    params = {"latitude": SORRISO[0] + location * 0.01, "longitude": SORRISO[1]}
+
+    if route == "forecast":
+        return route, "/api/forecast", params
+    elif route == "temp_stress":
+        return route, f"/api/predict/temp_stress/{random.choice(CROPS)}", params
+    return route, "/api/predict/drought_stress", params
+
+
+async def run_client(client: httpx.AsyncClient, deadline: float, num_locations: int, results: dict):
+    while time.perf_counter() < deadline:
+        route, path, params = make_request(num_locations)
+        start = time.perf_counter()
+        try:
+            response = await client.get(path, params=params)
+            ok = response.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        latency = time.perf_counter() - start
+
+        latencies, errors = results.setdefault(route, ([], [0]))
+        latencies.append(latency)
+        errors[0] += not ok
+
+
+async def main(url: str, concurrency: int, duration: float, num_locations: int):
+    results: dict[str, tuple[list[float], list[int]]] = {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        # Warm up every location through the predictions, the first one of a location fetches its history (the
+        # forecast route does not use it) and the forecast, then the results are cached
+        for location in range(num_locations):
+            params = {"latitude": SORRISO[0] + location * 0.01, "longitude": SORRISO[1]}
+            await client.get("/api/predict/temp_stress", params=params)
+            await client.get("/api/predict/drought_stress", params=params)
+
+        start = time.perf_counter()
+        deadline = start + duration
+        await asyncio.gather(*(run_client(client, deadline, num_locations, results) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    print(
+        f"{'route':>16} {'requests':>10} {'errors':>8} {'req/s':>8} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10}"
+    )
+    all_latencies = []
+    for route, (latencies, errors) in sorted(results.items()):
+        all_latencies += latencies
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        print(
+            f"{route:>16} {len(latencies):>10} {errors[0]:>8} {len(latencies) / elapsed:>8.1f} "
+            f"{p50:>10.1f} {p95:>10.1f} {p99:>10.1f}"
+        )
+
+    p50, p95, p99 = np.percentile(all_latencies, [50, 95, 99]) * 1000
+    total_errors = sum(errors[0] for _, errors in results.values())
+    print(
+        f"{'all':>16} {len(all_latencies):>10} {total_errors:>8} {len(all_latencies) / elapsed:>8.1f} "
+        f"{p50:>10.1f} {p95:>10.1f} {p99:>10.1f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the backend with concurrent mixed traffic")
+    parser.add_argument("--url", default="http://localhost:8123", help="Base URL of the running backend")
+    parser.add_argument("--concurrency", type=int, default=32, help="Number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="Duration of the test in seconds")
+    parser.add_argument("--locations", type=int, default=10, help="Number of distinct locations requested")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.url, args.concurrency, args.duration, args.locations))
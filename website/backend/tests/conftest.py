@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the backend import each other from the app directory, as when main.py is run
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
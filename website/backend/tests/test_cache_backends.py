@@ -0,0 +1,203 @@
+import time
+import pickle
+import threading
+import asyncio
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from util.timed_cache import CacheCategory, TimedCache, cached
+from util.cache_backends import RedisCacheBackend, SQLiteCacheBackend, TieredCache
+
+CATEGORY = CacheCategory.WEATHER_FORECAST
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def backend(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        return SQLiteCacheBackend(str(tmp_path / "cache.db"))
+
+    fakeredis = pytest.importorskip("fakeredis")
+    import redis
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, "from_url", lambda url: fakeredis.FakeRedis(server=server))
+    return RedisCacheBackend("redis://localhost:6379/0")
+
+
+def make_front() -> TimedCache:
+    cache = object.__new__(TimedCache)
+    cache.__init__()
+    return cache
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        {"temp_stress": [1.5, 2.0], "weeks": 12},
+        [1, "two", 3.0],
+        pd.DataFrame({"date": ["2025-01-01", "2025-01-02"], "temp_max": [30.5, 31.0]}),
+    ],
+    ids=["dict", "list", "dataframe"],
+)
+def test_round_trip(backend, value):
+    backend.set("key", value, 60, 30, CATEGORY)
+    record = backend.get_record("key")
+
+    assert record.ttl == 60
+    assert record.stale_seconds == 30
+    assert record.category == CATEGORY
+    if isinstance(value, pd.DataFrame):
+        pd.testing.assert_frame_equal(record.value, value)
+    else:
+        assert record.value == value
+
+
+@pytest.mark.parametrize("value", [np.arange(3), {"weeks": np.arange(3)}, "value"], ids=["array", "nested", "string"])
+def test_values_that_would_be_pickled_are_rejected(backend, value):
+    with pytest.raises(TypeError):
+        backend.set("key", value, 60)
+    assert backend.get_record("key") is None
+
+
+def test_pickled_entries_are_ignored(tmp_path):
+    backend = SQLiteCacheBackend(str(tmp_path / "cache.db"))
+    backend.set("key", {"value": 1}, 60)
+    backend._connection().execute(
+        "UPDATE cache SET format = 'pickle', value = ? WHERE key = 'key'", (pickle.dumps({"value": 1}),)
+    )
+    assert backend.get_record("key") is None
+
+
+def test_expired_and_stale_entries(backend):
+    backend.set("stale", {"value": 1}, 1, 60, CATEGORY, timestamp=time.time() - 2)
+    backend.set("expired", {"value": 1}, 1, 1, CATEGORY, timestamp=time.time() - 3)
+
+    assert backend.get_entry("stale") == ({"value": 1}, False)
+    assert backend.get("stale") is None
+    assert backend.get_record("expired") is None
+
+
+def test_delete_and_invalidate_category(backend):
+    backend.set("a", [1], 60, category=CATEGORY)
+    backend.set("b", [2], 60, category=CacheCategory.DB_DATA)
+
+    assert backend.delete("a")
+    assert not backend.delete("a")
+    backend.set("a", [1], 60, category=CATEGORY)
+    assert backend.invalidate_category(CATEGORY) == 1
+    assert backend.get("a") is None
+    assert backend.get("b") == [2]
+
+
+def test_lock_is_exclusive_until_unlocked(backend):
+    assert backend.try_lock("key", 60)
+    assert not backend.try_lock("key", 60)
+
+    backend.unlock("key")
+    assert backend.try_lock("key", 60)
+
+
+def test_lock_of_another_worker(backend):
+    other = type(backend).__new__(type(backend))
+    other.__dict__.update(backend.__dict__)
+    other.owner = "other-worker"
+
+    assert other.try_lock("key", 60)
+    assert not backend.try_lock("key", 60)
+    backend.unlock("key")  # Only the owner releases the lock
+    assert not backend.try_lock("key", 60)
+
+
+def test_expired_lock_is_taken_over(backend):
+    assert backend.try_lock("key", 0.05)
+    time.sleep(0.1)
+    assert backend.try_lock("key", 60)
+
+
+def test_tiered_cache_copies_back_entries_to_the_front(backend):
+    tiered = TieredCache(make_front(), backend)
+    backend.set("key", {"value": 1}, 60, category=CATEGORY)
+
+    assert tiered.get("key") == {"value": 1}
+    assert tiered.front.get("key") == {"value": 1}
+
+
+def test_tiered_cache_serves_stale_front_without_reading_the_back(backend, monkeypatch):
+    tiered = TieredCache(make_front(), backend)
+    tiered.set("key", ["old"], 1, 60, CATEGORY, timestamp=time.time() - 2)
+
+    reads = []
+    get_record = backend.get_record
+    monkeypatch.setattr(backend, "get_record", lambda key: reads.append(key) or get_record(key))
+    for _ in range(5):
+        assert tiered.get_entry("key") == (["old"], False)
+    assert reads == []
+
+    # Revalidation finds the value refreshed by another worker
+    backend.set("key", ["new"], 60, 60, CATEGORY)
+    assert tiered.get("key") == ["new"]
+    assert tiered.get_entry("key") == (["new"], True)
+
+
+def test_stale_refresh_uses_the_value_of_another_worker(backend):
+    tiered = TieredCache(make_front(), backend)
+    calls = []
+
+    @cached(tiered, CATEGORY, ttl_seconds=60, stale_seconds=60)
+    async def compute():
+        calls.append(None)
+        return ["computed"]
+
+    async def run():
+        assert await compute() == ["computed"]
+        key = next(iter(tiered.front.cache))
+        tiered.front.set(key, ["computed"], 60, 60, CATEGORY, timestamp=time.time() - 61)
+        backend.set(key, ["shared"], 60, 60, CATEGORY)
+
+        assert await compute() == ["computed"]  # Stale value, the refresh runs in the background
+        await asyncio.sleep(0.05)
+        return await compute()
+
+    assert asyncio.run(run()) == ["shared"]
+    assert len(calls) == 1
+
+
+def test_shared_backend_is_called_outside_the_event_loop(backend, monkeypatch):
+    threads = set()
+    for name in ("get_record", "set", "try_lock", "unlock"):
+        method = getattr(backend, name)
+        monkeypatch.setattr(
+            backend, name, lambda *args, method=method: threads.add(threading.get_ident()) or method(*args)
+        )
+
+    @cached(backend, CATEGORY, ttl_seconds=60, stale_seconds=60)
+    async def compute():
+        return {"value": 1}
+
+    async def run():
+        assert await compute() == {"value": 1}
+        assert await compute() == {"value": 1}
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert threads and loop_thread not in threads
+
+
+def test_tiered_cache_serves_the_front_on_the_event_loop(backend, monkeypatch):
+    tiered = TieredCache(make_front(), backend)
+    calls = []
+
+    @cached(tiered, CATEGORY, ttl_seconds=60)
+    async def compute():
+        calls.append(None)
+        return {"value": 1}
+
+    async def run():
+        await compute()
+        monkeypatch.setattr(asyncio, "to_thread", None)  # Fails if the backend is used again
+        return await compute()
+
+    assert asyncio.run(run()) == {"value": 1}
+    assert len(calls) == 1
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from neural_networks.feature_buffer import TemperatureFeatureBuffer
+
+HISTORY_DAYS = 5
+FORECAST_DAYS = 2
+HISTORY_SIZE = 2 * HISTORY_DAYS  # Maximum and minimum temperature of each day
+
+
+def make_inputs(seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return (
+        rng.random(HISTORY_DAYS).astype(np.float32),
+        rng.random(HISTORY_DAYS).astype(np.float32),
+        rng.random((FORECAST_DAYS, 2)).astype(np.float32),
+    )
+
+
+def test_features_alternate_the_temperatures():
+    buffer = TemperatureFeatureBuffer(HISTORY_DAYS, FORECAST_DAYS)
+    temp_max, temp_min, forecast = make_inputs()
+    features = buffer.get("day-1", temp_max, temp_min, forecast)
+
+    assert features.dtype == np.float32
+    assert features.shape == (2 * (HISTORY_DAYS + FORECAST_DAYS),)
+    np.testing.assert_array_equal(features[0:HISTORY_SIZE:2], temp_max)
+    np.testing.assert_array_equal(features[1:HISTORY_SIZE:2], temp_min)
+    np.testing.assert_array_equal(features[HISTORY_SIZE:], forecast.reshape(-1))
+    assert not features.flags.writeable
+
+
+def test_same_inputs_share_the_features():
+    buffer = TemperatureFeatureBuffer(HISTORY_DAYS, FORECAST_DAYS)
+    temp_max, temp_min, forecast = make_inputs()
+    features = buffer.get("day-1", temp_max, temp_min, forecast)
+
+    assert buffer.get("day-1", temp_max, temp_min, forecast.copy()) is features
+
+
+def test_new_forecast_keeps_the_history_and_the_previous_features():
+    buffer = TemperatureFeatureBuffer(HISTORY_DAYS, FORECAST_DAYS)
+    temp_max, temp_min, forecast = make_inputs()
+    features = buffer.get("day-1", temp_max, temp_min, forecast)
+    previous = features.copy()
+
+    new_forecast = forecast + 1
+    # The history is not read again when its key did not change
+    new_features = buffer.get("day-1", temp_max * 0, temp_min * 0, new_forecast)
+
+    assert new_features is not features
+    np.testing.assert_array_equal(features, previous)
+    np.testing.assert_array_equal(new_features[:HISTORY_SIZE], previous[:HISTORY_SIZE])
+    np.testing.assert_array_equal(new_features[HISTORY_SIZE:], new_forecast.reshape(-1))
+
+
+def test_new_history_key_rewrites_the_history():
+    buffer = TemperatureFeatureBuffer(HISTORY_DAYS, FORECAST_DAYS)
+    temp_max, temp_min, forecast = make_inputs()
+    buffer.get("day-1", temp_max, temp_min, forecast)
+
+    new_max, new_min, _ = make_inputs(seed=1)
+    features = buffer.get("day-2", new_max, new_min, forecast)
+    np.testing.assert_array_equal(features[0:HISTORY_SIZE:2], new_max)
+    np.testing.assert_array_equal(features[1:HISTORY_SIZE:2], new_min)
+
+
+def test_missing_forecast_values_still_match():
+    buffer = TemperatureFeatureBuffer(HISTORY_DAYS, FORECAST_DAYS)
+    temp_max, temp_min, forecast = make_inputs()
+    forecast[0, 0] = np.nan
+    features = buffer.get("day-1", temp_max, temp_min, forecast)
+
+    assert buffer.get("day-1", temp_max, temp_min, forecast.copy()) is features
+
+
+@pytest.mark.parametrize(
+    "history_days, forecast_shape",
+    [(HISTORY_DAYS - 1, (FORECAST_DAYS, 2)), (HISTORY_DAYS, (FORECAST_DAYS + 1, 2)), (HISTORY_DAYS, (FORECAST_DAYS,))],
+)
+def test_wrong_lengths_are_rejected(history_days, forecast_shape):
+    buffer = TemperatureFeatureBuffer(HISTORY_DAYS, FORECAST_DAYS)
+    with pytest.raises(ValueError):
+        buffer.get("day-1", np.zeros(history_days), np.zeros(history_days), np.zeros(forecast_shape))
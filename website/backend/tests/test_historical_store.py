@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from util.historical_store import HISTORICAL_COLUMNS, HistoricalWeatherStore
+
+
+def make_weather(first_day: str, last_day: str, seed: int = 0) -> pd.DataFrame:
+    dates = pd.date_range(first_day, last_day)
+    rng = np.random.default_rng(seed)
+    weather_df = pd.DataFrame({column: rng.random(len(dates)) * 30 for column in HISTORICAL_COLUMNS})
+    weather_df.insert(0, "date", dates.strftime("%Y-%m-%d"))
+    return weather_df
+
+
+def day(date: str) -> np.datetime64:
+    return np.datetime64(date, "D")
+
+
+@pytest.fixture
+def store(tmp_path) -> HistoricalWeatherStore:
+    return HistoricalWeatherStore(str(tmp_path / "store"))
+
+
+def test_empty_store(store):
+    assert store.num_days == 0
+    assert store.end_date is None
+    assert all(len(values) == 0 for values in store.window(day("2025-01-01"), day("2025-01-31")).values())
+
+
+def test_write_and_window(store):
+    weather_df = make_weather("2025-01-01", "2025-01-31")
+    store.write(weather_df)
+
+    assert store.start_date == day("2025-01-01")
+    assert store.end_date == day("2025-01-31")
+    window = store.window(day("2025-01-10"), day("2025-01-12"))
+    np.testing.assert_array_equal(window["temp_max"], weather_df["temp_max"].to_numpy(np.float32)[9:12])
+
+
+def test_append_days(store):
+    first = make_weather("2025-01-01", "2025-01-31", seed=1)
+    second = make_weather("2025-02-01", "2025-02-10", seed=2)
+    store.write(first)
+    store.write(second)
+
+    assert store.num_days == 41
+    expected = np.concatenate([first["rainfall_sum"], second["rainfall_sum"]]).astype(np.float32)
+    np.testing.assert_array_equal(store.columns["rainfall_sum"], expected)
+
+
+def test_gap_is_filled_with_nan(store):
+    store.write(make_weather("2025-01-01", "2025-01-10"))
+    store.write(make_weather("2025-01-15", "2025-01-20"))
+
+    assert store.num_days == 20
+    assert np.isnan(store.columns["temp_min"][10:14]).all()
+    assert not np.isnan(store.columns["temp_min"][14:]).any()
+
+
+def test_write_replaces_existing_days(store):
+    store.write(make_weather("2025-01-01", "2025-01-31", seed=1))
+    version = store.version
+    replacement = make_weather("2025-01-05", "2025-01-06", seed=3)
+    store.write(replacement)
+
+    assert store.num_days == 31
+    assert store.version != version
+    assert HistoricalWeatherStore(store.directory).version == store.version
+    np.testing.assert_array_equal(store.columns["temp_avg"][4:6], replacement["temp_avg"].to_numpy(np.float32))
+
+
+def test_shift_writes_a_new_generation(store):
+    later = make_weather("2025-02-01", "2025-02-28", seed=1)
+    earlier = make_weather("2025-01-01", "2025-01-10", seed=2)
+    store.write(later)
+    store.write(earlier)
+
+    assert store.start_date == day("2025-01-01")
+    assert store.end_date == day("2025-02-28")
+    values = store.columns["evaporation_sum"]
+    np.testing.assert_array_equal(values[:10], earlier["evaporation_sum"].to_numpy(np.float32))
+    assert np.isnan(values[10:31]).all()
+    np.testing.assert_array_equal(values[31:], later["evaporation_sum"].to_numpy(np.float32))
+
+    # Only the files of the current generation are left
+    files = set(os.listdir(store.directory))
+    assert "evaporation_sum.1.f32" in files
+    assert "evaporation_sum.f32" not in files
+
+
+def test_reader_keeps_its_state_until_reload(store):
+    store.write(make_weather("2025-02-01", "2025-02-28", seed=1))
+    reader = HistoricalWeatherStore(store.directory)
+    sums = reader.window_sums(day("2025-02-01"), day("2025-02-28"))
+
+    store.write(make_weather("2025-01-01", "2025-01-10", seed=2))
+    assert reader.window_sums(day("2025-02-01"), day("2025-02-28")) == sums
+
+    reader.reload()
+    assert reader.start_date == day("2025-01-01")
+    assert reader.window_sums(day("2025-02-01"), day("2025-02-28")) == pytest.approx(sums)
+
+
+def test_prefix_sums_match_the_values(store):
+    store.write(make_weather("2025-01-01", "2025-01-20", seed=1))
+    store.write(make_weather("2025-01-25", "2025-02-10", seed=2))
+    store.write(make_weather("2024-12-20", "2024-12-22", seed=3))
+
+    first, last = day("2024-12-21"), day("2025-02-05")
+    window = store.window(first, last)
+    sums = store.window_sums(first, last)
+    means = store.window_means(first, last)
+    for column in HISTORICAL_COLUMNS:
+        values = window[column].astype(np.float64)
+        assert sums[column] == pytest.approx(np.nansum(values))
+        assert means[column] == pytest.approx(np.nanmean(values))
+
+    # Prefix sums are persisted and read back by a new store
+    assert HistoricalWeatherStore(store.directory).window_sums(first, last) == pytest.approx(sums)
+
+
+def test_window_is_limited_to_the_stored_days(store):
+    store.write(make_weather("2025-01-01", "2025-01-10"))
+
+    assert len(store.window(day("2024-12-01"), day("2025-01-03"))["temp_max"]) == 3
+    assert len(store.window(day("2025-02-01"), day("2025-02-03"))["temp_max"]) == 0
+    assert np.isnan(store.window_means(day("2025-02-01"), day("2025-02-03"))["temp_max"])
+    assert store.window_sums(day("2025-02-01"), day("2025-02-03"))["temp_max"] == 0
@@ -0,0 +1,169 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+from util.timed_cache import CacheCategory, TimedCache, cached
+
+FORECAST = CacheCategory.WEATHER_FORECAST
+TEMP_STRESS = CacheCategory.TEMP_STRESS_PREDICTION
+
+
+def make_cache(**limits) -> TimedCache:
+    # TimedCache is a singleton, the tests use their own instances to choose the limits
+    cache = object.__new__(TimedCache)
+    cache.__init__(**limits)
+    return cache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = make_cache(max_entries=2)
+    cache.set("a", 1, 60)
+    cache.set("b", 2, 60)
+    assert cache.get("a") == 1  # b is now the least recently used
+
+    cache.set("c", 3, 60)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_category_quota_only_evicts_its_own_entries():
+    cache = make_cache(max_entries=100, category_max_entries={FORECAST.value: 2})
+    cache.set("other", 0, 60, category=TEMP_STRESS)
+    for key in ("f1", "f2", "f3"):
+        cache.set(key, key, 60, category=FORECAST)
+
+    assert cache.get("f1") is None
+    assert cache.get("f2") == "f2"
+    assert cache.get("f3") == "f3"
+    assert cache.get("other") == 0
+
+
+def test_byte_quota_evicts_until_it_fits():
+    value = "x" * 1000
+    cache = make_cache(max_bytes=2500)
+    for key in ("a", "b", "c"):
+        cache.set(key, value, 60)
+
+    assert cache.get("a") is None
+    assert cache.get("c") == value
+    assert cache.total_bytes <= 2500
+
+
+def test_value_larger_than_the_cache_is_not_stored():
+    cache = make_cache(max_bytes=100)
+    cache.set("big", "x" * 1000, 60)
+    assert cache.get("big") is None
+    assert cache.total_bytes == 0
+
+
+def test_stale_entry_is_served_but_not_fresh():
+    cache = make_cache()
+    cache.set("key", "value", 1, stale_seconds=60, timestamp=time.time() - 2)
+    assert cache.get_entry("key") == ("value", False)
+    assert cache.get("key") is None
+
+    cache.set("expired", "value", 1, stale_seconds=1, timestamp=time.time() - 3)
+    assert cache.get_entry("expired") is None
+    assert cache.cleanup_expired() == 0  # Already removed when read
+
+
+def test_invalidate_category():
+    cache = make_cache()
+    cache.set("f", 1, 60, category=FORECAST)
+    cache.set("t", 2, 60, category=TEMP_STRESS)
+
+    assert cache.invalidate_category(FORECAST) == 1
+    assert cache.get("f") is None
+    assert cache.get("t") == 2
+
+
+def test_concurrent_async_calls_share_one_computation():
+    cache = make_cache()
+    calls = []
+
+    @cached(cache, FORECAST, ttl_seconds=60)
+    async def compute(x):
+        calls.append(x)
+        await asyncio.sleep(0.05)
+        return x * 2
+
+    async def run():
+        return await asyncio.gather(*(compute(3) for _ in range(10)))
+
+    assert asyncio.run(run()) == [6] * 10
+    assert calls == [3]
+
+
+def test_concurrent_sync_calls_share_one_computation():
+    cache = make_cache()
+    calls = []
+    started = threading.Barrier(8)
+
+    @cached(cache, FORECAST, ttl_seconds=60)
+    def compute(x):
+        calls.append(x)
+        time.sleep(0.05)
+        return x * 2
+
+    results = []
+
+    def call():
+        started.wait()
+        results.append(compute(4))
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [8] * 8
+    assert calls == [4]
+
+
+def test_stale_value_is_refreshed_once_in_the_background():
+    cache = make_cache()
+    calls = []
+
+    @cached(cache, FORECAST, ttl_seconds=60, stale_seconds=60)
+    async def compute(x):
+        calls.append(x)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def run():
+        assert await compute(1) == 1
+        key = next(iter(cache.cache))
+        entry = cache.cache[key]
+        cache.set(key, entry.value, entry.ttl, entry.stale_seconds, entry.category, timestamp=time.time() - 61)
+
+        # Served stale while a single refresh runs
+        assert await asyncio.gather(*(compute(1) for _ in range(5))) == [1] * 5
+        await asyncio.sleep(0.1)
+        return await compute(1)
+
+    assert asyncio.run(run()) == 2
+    assert calls == [1, 1]
+
+
+def test_errors_are_raised_to_every_caller_and_not_cached():
+    cache = make_cache()
+    calls = []
+
+    @cached(cache, FORECAST, ttl_seconds=60)
+    async def fail():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("unavailable")
+
+    async def run():
+        results = await asyncio.gather(fail(), fail(), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        with pytest.raises(RuntimeError):
+            await fail()
+
+    asyncio.run(run())
+    assert len(calls) == 2